@@ -0,0 +1,176 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from itertools import islice
+from tools import *
+from search_engine import SearchEngine
+from transposition import move_to_packed
+
+# Batch analysis of finished games. Every position of every game is searched twice: once
+# for the best move, and once restricted to the move played, so the difference of the two
+# scores at the same depth is what the played move lost. Games are read from a file, one
+# game per line as msg2move strings separated by spaces or commas, black first. The results
+# are JSON lines written in input order, which lets an interrupted run resume after the
+# last line written.
+
+ANALYSIS_BATCH = 8  # Positions in flight per worker, bounds the memory of a run
+ANALYSIS_BLUNDER = 200  # Loss of a move above which it is flagged as a blunder
+
+
+def parse_game(line):
+    # msg2move strings of a game line, raises ValueError on a malformed or illegal move
+    moves = line.replace(",", " ").split()
+    board = new_board()
+    for ply, msg in enumerate(moves):
+        if len(msg) != (2 if ply == 0 else 4) or any(not "A" <= char <= "S" for char in msg):
+            raise ValueError(f"bad move {msg} at ply {ply}")
+        cells = {pos.x * Defines.GRID_NUM + pos.y for pos in msg2move(msg).positions}
+        if len(cells) != (1 if ply == 0 else 2) or any(board[cell] != Defines.NOSTONE for cell in cells):
+            raise ValueError(f"illegal move {msg} at ply {ply}")
+        for cell in cells:
+            board[cell] = Defines.BLACK if ply % 2 == 0 else Defines.WHITE
+    return moves
+
+
+def read_tasks(path, depth, time_budget, resume_after=None):
+    # Stream the positions to search as (game, ply, moves before it, played move, depth,
+    # time budget), the game being the line number. Positions up to resume_after, a (game,
+    # ply) pair, are skipped. Bad games are yielded as (game, error message).
+    with open(path) as file:
+        for game, line in enumerate(file, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            if resume_after and game < resume_after[0]:
+                continue
+            try:
+                moves = parse_game(line)
+            except ValueError as error:
+                if not resume_after or game > resume_after[0]:
+                    yield game, str(error)
+                continue
+            for ply in range(1, len(moves)):
+                if resume_after and (game, ply) <= resume_after:
+                    continue
+                yield game, ply, moves[:ply], moves[ply], depth, time_budget
+
+
+def analyze_position(task):
+    # Search one position of a game, returns its result record
+    if len(task) == 2:
+        game, error = task
+        return {"game": game, "error": error}
+    game, ply, moves, played, depth, time_budget = task
+    engine = SearchEngine.m_worker
+    start = time.perf_counter()
+    board, color, last_move = board_from_moves(moves)
+    record = {"game": game, "ply": ply, "color": "black" if color == Defines.BLACK else "white", "played": played}
+    if is_win_by_premove(board, last_move):
+        record["error"] = "game already over"
+        return record
+
+    # Every position starts from an empty table and history, so its record does not depend
+    # on the positions the worker searched before, the number of workers or the resume point
+    engine.transposition_table.clear()
+    engine.clear_move_ordering()
+    bestMove = engine.search(board, color, last_move, depth, time_budget)
+    score = bestMove.score
+    depth = engine.m_iterations[-1][0] if engine.m_iterations else depth
+    nodes = engine.m_total_nodes
+
+    # The played move alone at the depth the best move was found at
+    if msg2move(played) == bestMove:
+        played_score = score
+    else:
+        first, second = [pos.x * Defines.GRID_NUM + pos.y for pos in msg2move(played).positions]
+        engine.before_search(board, color, max(depth, 1))
+        engine.m_root_cells = [first, second]
+        engine.m_root_firsts = [first]
+        try:
+            played_score = engine.alpha_beta_search(max(depth, 1), Defines.MININT, Defines.MAXINT, color,
+                                                    move_to_packed(last_move))
+        finally:
+            engine.m_root_cells = None
+            engine.m_root_firsts = None
+        nodes += engine.m_total_nodes
+
+    record.update({
+        "best": str(bestMove),
+        "score": round(score, 3),
+        "played_score": round(played_score, 3),
+        "loss": round(max(0, score - played_score), 3),
+        "depth": depth,
+        "nodes": nodes,
+        "time": round(time.perf_counter() - start, 4),
+    })
+    return record
+
+
+def last_record(path):
+    # (game, ply) of the last complete line of an output file, None when there is none. A
+    # line cut by an interruption is removed so the file can be appended to.
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb+") as file:
+        data = file.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            file.truncate(end)
+    for line in reversed(data[:end].splitlines()):
+        if line.strip():
+            record = json.loads(line)
+            return record["game"], record.get("ply", float('inf'))
+    return None
+
+
+def run_analysis(path, output, depth, time_budget=None, workers=1, blunder=ANALYSIS_BLUNDER, resume=False):
+    # Analyze the games of path and write the JSON lines to the output stream or file
+    resume_after = last_record(output) if resume and isinstance(output, str) else None
+    stream = open(output, "a" if resume else "w") if isinstance(output, str) else output
+    tasks = read_tasks(path, depth, time_budget, resume_after)
+    pool = multiprocessing.Pool(workers, initializer=SearchEngine.init_worker) if workers > 1 else None
+    if pool is None:
+        SearchEngine.init_worker()
+    try:
+        while True:
+            # Pool.imap would read the whole input ahead, so the tasks go in bounded batches
+            batch = list(islice(tasks, ANALYSIS_BATCH * workers))
+            if not batch:
+                break
+            results = pool.imap(analyze_position, batch) if pool else map(analyze_position, batch)
+            for record in results:
+                if "loss" in record:
+                    record["blunder"] = record["loss"] >= blunder
+                stream.write(json.dumps(record) + "\n")
+            stream.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if stream is not output:
+            stream.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="analyze", description="Search every position of finished games.")
+    parser.add_argument("games", help="file of games, one per line")
+    parser.add_argument("--output", help="JSON lines file, standard output by default")
+    parser.add_argument("--depth", type=int, default=2, help="search depth of every position")
+    parser.add_argument("--time", type=int, help="search every position for this many ms instead")
+    parser.add_argument("--workers", type=int, default=1, help="processes searching in parallel")
+    parser.add_argument("--blunder", type=float, default=ANALYSIS_BLUNDER, help="loss flagged as a blunder")
+    parser.add_argument("--resume", action="store_true", help="continue after the last line of --output")
+    args = parser.parse_args(argv)
+    if args.resume and not args.output:
+        parser.error("--resume needs --output")
+
+    run_analysis(args.games, args.output or sys.stdout, args.depth, args.time / 1000 if args.time else None,
+                 max(1, args.workers), args.blunder, args.resume)
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
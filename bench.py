@@ -0,0 +1,128 @@
+import argparse
+import json
+import sys
+import time
+from tools import *
+from search_engine import SearchEngine
+
+# Benchmark corpus. Moves are in msg2move notation, black plays first, and the side to
+# move is the one after the last move. Every position is searched at its own depth. Only
+# tactical-win is decided by the threat solver, the others reach the main search.
+BENCH_POSITIONS = [
+    {"name": "opening-1", "depth": 2, "moves": ["JJ"]},
+    {"name": "opening-2", "depth": 2, "moves": ["JJ", "KJKK"]},
+    {"name": "opening-3", "depth": 2, "moves": ["JJ", "IKKI", "HHJL"]},
+    {"name": "middle-1", "depth": 2, "moves": ["JJ", "JIKJ", "KIIH", "IJLH", "IIHH", "LILG", "GGKK"]},
+    {"name": "middle-2", "depth": 2, "moves": ["JJ", "JIKJ", "KIIH", "LGKH", "IJIK", "MFLI", "HLNE", "GMMG",
+                                               "IMII"]},
+    {"name": "tactical-win", "depth": 2, "moves": ["JJ", "AAAB", "KJLJ", "ASBS", "FFFG", "SASB"]},
+    {"name": "tactical-defend", "depth": 2, "moves": ["JJ", "AAAB", "KJLJ", "ASBS", "MJGG"]},
+    {"name": "tactical-race", "depth": 2, "moves": ["JJ", "JIKJ", "KIIH", "LGKH", "IJIK", "MFLI", "HLNE", "GMMG",
+                                                    "IMII", "IGIL", "GKFJ"]},
+]
+# Relative changes above this are reported as regressions by the compare mode.
+BENCH_THRESHOLD = 0.10
+BENCH_MIN_TIME = 0.1
+
+
+def bench_position(engine, position, depth=None, time_budget=None):
+    # Search one position from an empty transposition table and collect its statistics
+    depth = depth or position["depth"]
+    board, color, last_move = board_from_moves(position["moves"])
+    engine.transposition_table.clear()
+    start = time.perf_counter()
+    bestMove = engine.search(board, color, last_move, depth, time_budget)
+    elapsed = time.perf_counter() - start
+    counters = engine.counters()
+    nodes = counters["nodes"]
+    return {
+        "name": position["name"],
+        "depth": engine.m_iterations[-1][0],
+        "nodes": nodes,
+        "threat_nodes": counters["threat_nodes"],
+        "quiescence_nodes": counters["quiescence_nodes"],
+        "researches": counters["researches"],
+        "reductions": counters["reductions"],
+        "aspiration_fails": counters["aspiration_fails"],
+        "time": round(elapsed, 4),
+        "nps": round(nodes / elapsed) if elapsed > 0 else 0,
+        "tt_hit_rate": round(engine.m_tt_hits / engine.m_tt_probes, 4) if engine.m_tt_probes else 0.0,
+        "cutoff_rate": round(engine.m_beta_pod / nodes, 4) if nodes else 0.0,
+        "first_cutoff_rate": round(engine.m_beta_first / engine.m_beta_pod, 4) if engine.m_beta_pod else 0.0,
+        "time_to_depth": {str(d): round(seconds, 4) for d, _, _, seconds, _ in engine.m_iterations},
+        "best_move": str(bestMove),
+        "score": round(bestMove.score, 3),
+    }
+
+
+def run_bench(depth=None, time_budget=None, engine=None):
+    # Run the whole corpus, returns the report as a dict
+    engine = engine or SearchEngine()
+    results = [bench_position(engine, position, depth, time_budget) for position in BENCH_POSITIONS]
+    nodes = sum(result["nodes"] for result in results)
+    seconds = sum(result["time"] for result in results)
+    return {
+        "positions": results,
+        "total": {"nodes": nodes, "time": round(seconds, 4), "nps": round(nodes / seconds) if seconds > 0 else 0},
+    }
+
+
+def compare(report, baseline, threshold=BENCH_THRESHOLD):
+    # Regressions of report against a saved baseline, as a list of messages
+    regressions = []
+    old_positions = {result["name"]: result for result in baseline["positions"]}
+    for result in report["positions"]:
+        old = old_positions.get(result["name"])
+        if old is None:
+            continue
+        # Speed of searches shorter than BENCH_MIN_TIME is mostly timer noise
+        if old["time"] >= BENCH_MIN_TIME and result["nps"] < old["nps"] * (1 - threshold):
+            regressions.append(f"{result['name']}: nps {old['nps']} -> {result['nps']}")
+        if old["depth"] == result["depth"] and result["nodes"] > old["nodes"] * (1 + threshold):
+            regressions.append(f"{result['name']}: nodes {old['nodes']} -> {result['nodes']}")
+        if old["best_move"] != result["best_move"]:
+            regressions.append(f"{result['name']}: best move {old['best_move']} -> {result['best_move']}")
+    old_nps, new_nps = baseline["total"]["nps"], report["total"]["nps"]
+    if old_nps and new_nps < old_nps * (1 - threshold):
+        regressions.append(f"total: nps {old_nps} -> {new_nps}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bench", description="Search the benchmark corpus and report JSON.")
+    parser.add_argument("--depth", type=int, help="search every position at this depth")
+    parser.add_argument("--time", type=int, help="search every position for this many ms instead")
+    parser.add_argument("--symmetry", action="store_true", help="share the TT entries of symmetric positions")
+    parser.add_argument("--aspiration", type=int, default=Defines.ASPIRATION_WINDOW,
+                        help="root window around the expected score, 0 for none")
+    parser.add_argument("--lmr", type=int, default=Defines.LMR_REDUCTION, help="plies taken off the late pairs")
+    parser.add_argument("--quiescence", type=int, default=Defines.QUIESCENCE_DEPTH,
+                        choices=range(Defines.MAX_DEPTH // 2 + 1), metavar="N",
+                        help="moves of the threat extension at the leaves")
+    parser.add_argument("--output", help="also write the report to this file, e.g. to save a baseline")
+    parser.add_argument("--compare", help="baseline report to compare with, exits with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=BENCH_THRESHOLD, help="relative change flagged")
+    args = parser.parse_args(argv)
+
+    engine = SearchEngine()
+    engine.set_symmetry(args.symmetry)
+    engine.m_aspiration_window = args.aspiration
+    engine.m_lmr_reduction = args.lmr
+    engine.m_quiescence_depth = args.quiescence
+    report = run_bench(args.depth, args.time / 1000 if args.time else None, engine)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
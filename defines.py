@@ -1,19 +1,55 @@
 class Defines:
     GRID_NUM = 21  # Number of the board, 19*19 plus edges.
     GRID_COUNT = 361  # Sum of the points in the board.
+    GRID_CELLS = 441  # Cells of the flat board, GRID_NUM * GRID_NUM including the border.
     BLACK = 1  # Black flag in the board.
     WHITE = 2  # White flag in the board.
     BORDER = 3  # Border flag in the board
     NOSTONE = 0  # Empty flag.
+    # Offsets of the four line directions (1, 0), (0, 1), (1, 1), (-1, 1) in the flat board.
+    DIRECTIONS = (21, 1, 22, -20)
     MSG_LENGTH = 512  # Tamaño del mensaje
     LOG_FILE = "tia-lbe-engine.log"
     ENGINE_NAME = "lbe"
     # Max values in the evaluation.
     MAXINT = 20000
     MININT = -20000
+    # Move generation.
+    CANDIDATE_RADIUS = 1  # Empty cells within this radius of any stone are candidate moves.
+    LAST_MOVE_RADIUS = 2  # Radius around the stones of the last move, added to the candidates.
+    FIRST_STONE_LIMIT = 16  # First stones searched below the root, best first; 0 searches all.
+    SECOND_STONE_LIMIT = 12  # Second stones searched per first stone, best gains first; 0 searches all.
+    # Principal variation search.
+    PVS_WINDOW = 0.01  # Width of the null window, the scores are not integers.
+    ASPIRATION_WINDOW = 0  # Root window around the score two iterations up, each side; 0 for none, try 250.
+    LMR_MIN_DEPTH = 4  # Plies left at a node reducing its late pairs, so a search reduces from depth 5.
+    LMR_FULL_PAIRS = 4  # Pairs of a node searched at full depth before the reductions start.
+    # Plies taken off a late pair, 0 for none. Even, as the scores swing between odd and even depths.
+    LMR_REDUCTION = 0
+    QUIESCENCE_DEPTH = 0  # Moves of the threat extension at the leaves, 0 for none.
+    # Time control.
+    MAX_DEPTH = 32  # Depth limit of a search driven by a time budget.
+    TIME_CHECK_NODES = 63  # The clock is checked when (nodes & TIME_CHECK_NODES) == 0.
+    NEXT_ITERATION_RATIO = 0.4  # No new iteration once this part of the budget is used.
+    TIMELEFT_MOVES = 30  # With "timeleft", the budget of a move is the time left over this.
+    PONDER_GUESS_DEPTH = 1  # Depth of the search guessing the opponent's reply when pondering.
+    # Threat-space search, depths are in attacker moves.
+    THREAT_ROOT_DEPTH = 4  # Depth of the solver run before the main search.
+    THREAT_ROOT_NODES = 1000  # Node limit of the solver run before the main search.
+    THREAT_TIME_RATIO = 0.25  # Share of the time budget the root solver may use.
+    THREAT_LEAF_DEPTH = 1  # Depth of the solver run at the leaves of the main search.
+    THREAT_LEAF_NODES = 50  # Node limit of the solver run at the leaves.
+    # Transposition table.
+    TT_SIZE_BITS = 18  # 2^18 buckets of 2 entries each.
+    ZOBRIST_SEED = 0x6C6265  # Fixed seed so Zobrist keys are reproducible.
+    TT_SYMMETRY = False  # Positions equal up to a board symmetry share their entries.
+    # Opening book.
+    BOOK_FILE = "book.bin"  # Book opened at start when it exists, see opening_book.py.
 
 
 class StonePosition:
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -24,9 +60,13 @@ class StonePosition:
         return self.x == other.x and self.y == other.y
 
     def __hash__(self):
-        return hash(f'{self.x}{self.y}')
+        return hash((self.x, self.y))
 
 class StoneMove:
+    # A move of the protocol. The search works on cell indices and packed moves, this is only
+    # made when a move is read or written.
+    __slots__ = ("positions", "score")
+
     def __init__(self, positions):
         self.positions = positions
         self.score = 0
@@ -34,17 +74,17 @@ class StoneMove:
     def __iter__(self):
         return iter(self.positions)
 
+    def stones(self):
+        # The (x, y) of the stones, sorted: the order of the two stones does not matter
+        return tuple(sorted((pos.x, pos.y) for pos in self.positions))
+
     def __eq__(self, other):
         if not isinstance(other, StoneMove):
             return False
-
-        return set(self.positions) == set(other.positions)
+        return self.stones() == other.stones()
 
     def __hash__(self):
-        items_list = list()
-        for item in self:
-            items_list.append(hash(item))
-        return hash(tuple(items_list))
+        return hash(self.stones())
 
     def __str__(self):
         if self.positions[0].x == self.positions[1].x and self.positions[0].y == self.positions[1].y:
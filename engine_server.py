@@ -0,0 +1,216 @@
+import argparse
+import collections
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from tools import *
+from game_engine import GameEngine
+from search_engine import SearchEngine
+from opening_book import OpeningBook
+from transposition import TranspositionTable, packed_to_move, move_to_packed
+
+# Engine server: many games at once over a TCP or Unix socket, each connection a session
+# speaking the usual command set. The searches of all sessions go to one bounded pool of
+# worker processes, which keep their SearchEngine and its transposition table warm from one
+# search to the next.
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 6006
+# Table of the engine of a session, which never searches, so it is as small as a table goes
+SESSION_TT_BITS = 0
+METRICS_WINDOW = 1000  # Moves kept for the latency percentiles
+
+
+class ServerMetrics:
+    # Throughput and latency of the server, updated by the session threads
+    def __init__(self):
+        self.m_lock = threading.Lock()
+        self.m_start = time.perf_counter()
+        self.m_sessions = 0  # Sessions since the start
+        self.m_active = 0  # Sessions connected now
+        self.m_games = 0  # "new" commands
+        self.m_moves = 0  # Moves answered
+        self.m_nodes = 0  # Nodes searched for them
+        self.m_latencies = collections.deque(maxlen=METRICS_WINDOW)  # Seconds to answer, recent moves
+
+    def session_started(self):
+        with self.m_lock:
+            self.m_sessions += 1
+            self.m_active += 1
+
+    def session_ended(self):
+        with self.m_lock:
+            self.m_active -= 1
+
+    def game_started(self):
+        with self.m_lock:
+            self.m_games += 1
+
+    def move_done(self, latency, nodes):
+        with self.m_lock:
+            self.m_moves += 1
+            self.m_nodes += nodes
+            self.m_latencies.append(latency)
+
+    def report(self):
+        with self.m_lock:
+            hours = (time.perf_counter() - self.m_start) / 3600
+            latencies = sorted(self.m_latencies)
+
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 4) if latencies else 0.0
+            return {
+                "uptime": round(hours * 3600, 1),
+                "sessions": self.m_sessions,
+                "active_sessions": self.m_active,
+                "games": self.m_games,
+                "moves": self.m_moves,
+                "nodes": self.m_nodes,
+                "games_per_hour": round(self.m_games / hours, 1) if hours else 0.0,
+                "moves_per_hour": round(self.m_moves / hours, 1) if hours else 0.0,
+                "latency_mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+                "latency_p50": percentile(0.5),
+                "latency_p95": percentile(0.95),
+                "latency_max": round(latencies[-1], 4) if latencies else 0.0,
+            }
+
+
+class SessionEngine(GameEngine):
+    # The game of one connection. Its searches run in the worker pool of the server, so it
+    # has no threads of its own, does not ponder, and its engine has no real table. The
+    # book of the server is shared by all sessions.
+
+    def __init__(self, server, output):
+        self.m_server = server
+        super().__init__(Defines.ENGINE_NAME, 1, output, SearchEngine(TranspositionTable(SESSION_TT_BITS)), None)
+        self.m_book = server.m_book
+        self.m_move_time = server.m_move_time  # Per-session limit, the "time" command changes it
+
+    def dispatch(self, msg):
+        if msg == "metrics":
+            self.send(json.dumps(self.m_server.m_metrics.report()))
+            return True
+        return super().dispatch(msg)
+
+    def handle_command(self, msg):
+        if msg.startswith("new"):
+            self.m_server.m_metrics.game_started()
+        return super().handle_command(msg)
+
+    def set_threads(self, threads):
+        # The server's pool does the searching
+        super().set_threads(1)
+
+    def start_ponder(self):
+        pass
+
+    def set_book(self, path):
+        # The server's book stays open for the other sessions
+        if self.m_book is self.m_server.m_book:
+            self.m_book = None
+        super().set_book(path)
+
+    def search_a_move(self, ourColor, bestMove):
+        start = time.perf_counter()
+        if self.book_move(ourColor, bestMove):
+            nodes = 0
+        else:
+            future = self.m_server.m_pool.submit(_search_position, bytes(self.m_board), ourColor,
+                                                 move_to_packed(bestMove), self.m_alphabeta_depth, self.time_budget(),
+                                                 self.m_search_engine.options())
+            move, score, depth, nodes = future.result()
+            bestMove.positions = packed_to_move(move).positions
+            bestMove.score = score
+            # Under the output lock, a readyok of the session's reader stays on its own line
+            with self.m_output_lock:
+                print(f"==================================", file=self.m_output)
+                print(f"AB Time:\t{time.perf_counter() - start:.3f}", file=self.m_output)
+                print(f"Depth:\t{depth}", file=self.m_output)
+                print(f"Node:\t{nodes}", file=self.m_output)
+                print(f"Score:\t{score:.3f}", file=self.m_output)
+        self.send(f"BestMove:\t{bestMove}")
+        self.m_server.m_metrics.move_done(time.perf_counter() - start, nodes)
+        return True
+
+
+class EngineServer:
+    def __init__(self, workers, move_time=None):
+        self.m_pool = ProcessPoolExecutor(workers, initializer=SearchEngine.init_worker)  # Bounded pool of the searches
+        self.m_metrics = ServerMetrics()
+        # Opening book of all the sessions, opened once
+        self.m_book = OpeningBook(Defines.BOOK_FILE) if os.path.exists(Defines.BOOK_FILE) else None
+        self.m_move_time = move_time  # Default move time of the sessions in ms, None for fixed depth
+
+    def serve(self, host=SERVER_HOST, port=SERVER_PORT, unix_path=None):
+        # Accept sessions until interrupted
+        if unix_path:
+            server = socketserver.ThreadingUnixStreamServer(unix_path, _SessionHandler)
+        else:
+            socketserver.ThreadingTCPServer.allow_reuse_address = True
+            server = socketserver.ThreadingTCPServer((host, port), _SessionHandler)
+        server.daemon_threads = True
+        server.m_engine_server = self
+        with server:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+    def close(self):
+        self.m_pool.shutdown(cancel_futures=True)
+        if self.m_book is not None:
+            self.m_book.close()
+        print(json.dumps(self.m_metrics.report()), file=sys.stderr)
+
+
+class _SessionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server.m_engine_server
+        output = io.TextIOWrapper(self.wfile, encoding="utf-8", line_buffering=True)
+        session = SessionEngine(server, output)
+        server.m_metrics.session_started()
+        try:
+            for line in self.rfile:
+                if not session.dispatch(line.decode("utf-8", "replace").strip()):
+                    break
+            session.wait_search()
+        except OSError:
+            pass  # The client went away
+        finally:
+            server.m_metrics.session_ended()
+            session.set_book("off")
+
+
+def _search_position(board, ourColor, pre_move, depth, time_budget, options):
+    # Search one move in a worker process with the search options of the session, returns
+    # (packed move, score, depth, nodes)
+    engine = SearchEngine.m_worker
+    engine.set_options(options)
+    bestMove = engine.search(bytearray(board), ourColor, packed_to_move(pre_move), depth, time_budget)
+    return move_to_packed(bestMove), bestMove.score, engine.m_iterations[-1][0], engine.m_total_nodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="server", description="Serve many games over a socket.")
+    parser.add_argument("--host", default=SERVER_HOST, help="address to listen on")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="TCP port to listen on")
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=1, help="processes searching in parallel")
+    parser.add_argument("--move-time", type=int, help="default move time of the sessions in ms")
+    args = parser.parse_args(argv)
+
+    server = EngineServer(max(1, args.workers), args.move_time)
+    try:
+        server.serve(args.host, args.port, args.unix)
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,53 @@
 import cProfile
+import io
+import os
+import pstats
 from tools import *
 import sys
+import threading
+import queue
 from search_engine import SearchEngine
+from threat_search import ThreatSearch
+from transposition import packed_to_move, TranspositionTable
+from parallel_search import ParallelSearch
+from search_stats import SearchStats
+from opening_book import OpeningBook
 import time
+import json
+import bench
 
 class GameEngine:
-    def __init__(self, name=Defines.ENGINE_NAME):
+    def __init__(self, name=Defines.ENGINE_NAME, threads=1, output=None, search_engine=None,
+                 book_file=Defines.BOOK_FILE):
+        self.m_output = output if output is not None else sys.stdout  # Text stream the engine writes to
         self.m_chess_type = None
         if name and len(name) > 0:
             if len(name) < Defines.MSG_LENGTH:
                 self.m_engine_name = name
             else:
-                print(f"Too long Engine Name: {name}, should be less than: {Defines.MSG_LENGTH}")
+                print(f"Too long Engine Name: {name}, should be less than: {Defines.MSG_LENGTH}", file=self.m_output)
         self.m_alphabeta_depth = 2
-        self.m_board = t = [[0]*Defines.GRID_NUM for i in range(Defines.GRID_NUM)]
-        self.m_search_engine = SearchEngine()
+        self.m_move_time = None  # Budget of a move in ms set by "time", None for fixed depth
+        self.m_time_left = None  # Time left on our clock in ms set by "timeleft"
+        self.m_board = new_board()
+        self.m_search_engine = search_engine if search_engine is not None else SearchEngine()
+        self.m_stats = False
+        self.m_stats_path = None
+        self.m_threads = 1
+        self.set_threads(threads)
+        self.m_ponder = False  # Search on the opponent's time, set by "ponder on"
+        self.m_ponder_thread = None  # Background thread of the current ponder search
+        self.m_ponder_result = None  # (board after the guessed reply, our answer, completed depth)
+        self.m_search_thread = None  # Thread of the search of our move, None when not searching
+        self.m_output_lock = threading.Lock()  # Held while writing to stdout
+        # cProfile of every search printed on stderr, set by "profile on" or CONNECT6_PROFILE=1
+        self.m_profile = os.environ.get("CONNECT6_PROFILE", "0") not in ("", "0", "off")
+        # Phase timers and counters of every search, set by "stats on" or CONNECT6_STATS=1, written on
+        # stderr or, when m_stats_path is set by "stats <file>" or CONNECT6_STATS=<file>, to that file
+        self.set_stats(os.environ.get("CONNECT6_STATS", "off"))
+        self.m_book = None  # OpeningBook answering the known openings without a search
+        if book_file and os.path.exists(book_file):
+            self.set_book(book_file)
         self.init_game()
         self.m_best_move = StoneMove([StonePosition(0, 0), StonePosition(0, 0)])
 
@@ -34,63 +67,159 @@ class GameEngine:
             "              and the engine will search the move for the next step.\n"
             " new black   - start a new game and set the engine to black player.\n"
             " new white   - start a new game and set it to white.\n"
-            " help        - print this help.\n")
+            " depth d     - set the alpha beta search depth used without a time budget.\n"
+            " time ms     - search each move by iterative deepening for ms milliseconds, 0 to disable.\n"
+            " timeleft ms - tell the engine the time left on its clock, the budget is a share of it.\n"
+            " threads n   - search with n processes sharing one transposition table.\n"
+            " ponder on   - search the expected reply on the opponent's time, ponder off to stop.\n"
+            " symmetry on - let mirrored and rotated positions share their transposition table entries.\n"
+            " aspiration w - search the root in a window of w around the expected score, 0 to disable.\n"
+            " lmr n       - search the late pairs n plies shallower, even, 0 to disable.\n"
+            " quiescence n - follow the threats made at the leaves for n moves, 0 to disable.\n"
+            " profile on  - profile each search with cProfile, printed on stderr, profile off to stop.\n"
+            " stats on    - report phase timers and counters of each search on stderr, stats FILE\n"
+            "              appends them to FILE as JSON lines, stats off to stop.\n"
+            " book FILE   - answer from the opening book FILE while it knows the position, book off to stop.\n"
+            " bench [d]   - search the benchmark positions, at depth d if given, and print the report.\n"
+            " stop        - end the current search now and play its best move so far.\n"
+            " isready     - answered by readyok, even during a search.\n"
+            " help        - print this help.\n", file=self.m_output)
 
     def run(self):
-        msg = ""
+        # Commands are read by another thread and searches run in a third one, so "stop" and
+        # "isready" are answered while the engine thinks. Any other command waits for the
+        # search to finish, so a script of commands runs as it would one at a time.
         self.on_help()
+        commands = queue.Queue()
+        threading.Thread(target=read_commands, args=(commands,), daemon=True).start()
         while True:
-            msg = input().strip()
+            msg = commands.get()
+            if msg is None:
+                msg = "quit"  # End of input
             log_to_file(msg)
-            if msg == "name":
-                print(f"name {self.m_engine_name}")
-            elif msg == "exit" or msg == "quit":
+            if not self.dispatch(msg):
                 break
-            elif msg == "print":
-                print_board(self.m_board, self.m_best_move)
-            elif msg.startswith("black"):
-                self.m_best_move = msg2move(msg[6:])
+        return 0
+
+    def dispatch(self, msg):
+        # Answer the commands that do not wait for the search, pass the others to
+        # handle_command. False when the engine should quit. A malformed command is answered
+        # by an error line and the engine goes on.
+        try:
+            if msg == "stop":
+                self.stop_search()
+            elif msg == "isready":
+                self.send("readyok")
+            else:
+                return self.handle_command(msg)
+        except (ValueError, IndexError, TypeError):
+            self.send(f"error {msg}")
+        return True
+
+    def handle_command(self, msg):
+        # Run one command, False when the engine should quit
+        self.wait_search()
+        # Anything that may change the game or the engine ends the background search
+        if msg not in ("name", "print", "help"):
+            self.stop_ponder()
+        if msg == "name":
+            self.send(f"name {self.m_engine_name}")
+        elif msg == "exit" or msg == "quit":
+            self.set_threads(1)
+            return False
+        elif msg == "print":
+            print_board(self.m_board, self.m_best_move, self.m_output)
+        elif msg.startswith("black"):
+            self.m_best_move = msg2move(msg[6:])
+            make_move(self.m_board, self.m_best_move, Defines.BLACK)
+            self.m_chess_type = Defines.BLACK
+        elif msg.startswith("white"):
+            self.m_best_move = msg2move(msg[6:])
+            make_move(self.m_board, self.m_best_move, Defines.WHITE)
+            self.m_chess_type = Defines.WHITE
+        elif msg == "next":
+            self.m_chess_type = self.m_chess_type ^ 3
+            self.start_search()
+        elif msg.startswith("new"):
+            self.init_game()
+            self.m_search_engine.transposition_table.clear()
+            if msg[4:] == "black":
+                self.m_best_move = msg2move("JJ")
                 make_move(self.m_board, self.m_best_move, Defines.BLACK)
                 self.m_chess_type = Defines.BLACK
-            elif msg.startswith("white"):
-                self.m_best_move = msg2move(msg[6:])
-                make_move(self.m_board, self.m_best_move, Defines.WHITE)
+                self.send("move JJ")
+            else:
                 self.m_chess_type = Defines.WHITE
-            elif msg == "next":
-                self.m_chess_type = self.m_chess_type ^ 3
-                if self.search_a_move(self.m_chess_type, self.m_best_move):
-                    make_move(self.m_board, self.m_best_move, self.m_chess_type)
-                    msg = f"move {self.m_best_move}"
-                    print_board(self.m_board)
-                    print(msg)
-                    flush_output()
-            elif msg.startswith("new"):
-                self.init_game()
-                if msg[4:] == "black":
-                    self.m_best_move = msg2move("JJ")
-                    make_move(self.m_board, self.m_best_move, Defines.BLACK)
-                    self.m_chess_type = Defines.BLACK
-                    msg = "move JJ"
-                    print(msg)
-                    flush_output()
-                else:
-                    self.m_chess_type = Defines.WHITE
-            elif msg.startswith("move"):
-                self.m_best_move = msg2move(msg[5:])
-                make_move(self.m_board, self.m_best_move, self.m_chess_type ^ 3)
-                if is_win_by_premove(self.m_board, self.m_best_move):
-                    print("We lost!")
-                if self.search_a_move(self.m_chess_type, self.m_best_move):
-                    msg = f"move {self.m_best_move}"
-                    make_move(self.m_board, self.m_best_move, self.m_chess_type)
-                    print_board(self.m_board)
-                    print(msg)
-                    flush_output()
-            elif msg.startswith("depth"):
-                self.m_alphabeta_depth = self.m_alphabeta_depth
-            elif msg == "help":
-                self.on_help()
-        return 0
+        elif msg.startswith("move"):
+            self.m_best_move = msg2move(msg[5:])
+            make_move(self.m_board, self.m_best_move, self.m_chess_type ^ 3)
+            if is_win_by_premove(self.m_board, self.m_best_move):
+                print("We lost!", file=self.m_output)
+            self.start_search()
+        elif msg.startswith("depth"):
+            depth = int(msg[6:])
+            if depth < 1:
+                raise ValueError(f"depth {depth}")  # No iteration would run and there would be no move
+            self.m_alphabeta_depth = depth
+        elif msg.startswith("ponder"):
+            self.m_ponder = msg[7:] == "on"
+        elif msg.startswith("symmetry"):
+            self.m_search_engine.set_symmetry(msg[9:] == "on")
+        elif msg.startswith("aspiration"):
+            self.m_search_engine.m_aspiration_window = non_negative(msg[11:])
+        elif msg.startswith("lmr"):
+            self.m_search_engine.m_lmr_reduction = non_negative(msg[4:])
+        elif msg.startswith("quiescence"):
+            # The killer table has room for MAX_DEPTH plies below the leaves
+            self.m_search_engine.m_quiescence_depth = non_negative(msg[11:], Defines.MAX_DEPTH // 2)
+        elif msg.startswith("threads"):
+            self.set_threads(int(msg[8:]))
+        elif msg.startswith("timeleft"):
+            self.m_time_left = int(msg[9:]) or None
+        elif msg.startswith("time"):
+            self.m_move_time = int(msg[5:]) or None
+        elif msg.startswith("profile"):
+            self.m_profile = msg[8:] == "on"
+        elif msg.startswith("stats"):
+            self.set_stats(msg[6:])
+        elif msg.startswith("book"):
+            self.set_book(msg[5:])
+        elif msg.startswith("bench"):
+            self.bench(int(msg[6:]) if msg[6:] else None)
+        elif msg == "help":
+            self.on_help()
+        return True
+
+    def start_search(self):
+        # Search our move in the search thread, which plays and prints it when done
+        self.m_search_engine.m_stop = False
+        self.m_search_thread = threading.Thread(target=self.think, args=(self.m_chess_type,), daemon=True)
+        self.m_search_thread.start()
+
+    def think(self, ourColor):
+        if self.search_a_move(ourColor, self.m_best_move):
+            make_move(self.m_board, self.m_best_move, ourColor)
+            with self.m_output_lock:
+                print_board(self.m_board, file=self.m_output)
+            self.send(f"move {self.m_best_move}")
+            self.start_ponder()
+
+    def stop_search(self):
+        # Make the running search return the best move of its last completed iteration
+        if self.m_search_thread is not None:
+            self.m_search_engine.m_stop = True
+
+    def wait_search(self):
+        if self.m_search_thread is not None:
+            self.m_search_thread.join()
+            self.m_search_thread = None
+            self.m_search_engine.m_stop = False  # A stop that came after the search ends nothing else
+
+    def send(self, msg):
+        # Write one protocol line, whole even when two threads answer at once
+        with self.m_output_lock:
+            print(msg, file=self.m_output)
+            self.m_output.flush()
 
     def search_a_move(self, ourColor, bestMove):
         score = 0
@@ -98,25 +227,182 @@ class GameEngine:
         end = 0
 
         start = time.perf_counter()
+        time_budget = self.time_budget()
+        # The report is written under m_output_lock, so a readyok sent meanwhile stays on its own line
+        if self.book_move(ourColor, bestMove):
+            with self.m_output_lock:
+                print(f"==================================", file=self.m_output)
+                print(f"Book move:\t{time.perf_counter() - start:.3f}", file=self.m_output)
+                print(f"BestMove:\t{bestMove}", file=self.m_output)
+            return True
+        if self.ponder_hit(bestMove):
+            with self.m_output_lock:
+                print(f"==================================", file=self.m_output)
+                print(f"Ponder hit:\t{time.perf_counter() - start:.3f}", file=self.m_output)
+                print(f"BestMove:\t{bestMove}", file=self.m_output)
+            return True
         self.m_search_engine.before_search(self.m_board, self.m_chess_type, self.m_alphabeta_depth)
-        # Profile of alpha_beta_search
-        cProfile.runctx(
-            "score = self.m_search_engine.alpha_beta_search(self.m_alphabeta_depth, Defines.MININT, Defines.MAXINT, "
-            "ourColor, bestMove, bestMove)",
-           globals(), locals())
-        #score = self.m_search_engine.alpha_beta_search(self.m_alphabeta_depth, Defines.MININT, Defines.MAXINT, ourColor, bestMove, bestMove)
+        # With a time budget, deepen until it runs out, otherwise search to the fixed depth
+        max_depth = Defines.MAX_DEPTH if time_budget else self.m_alphabeta_depth
+        if self.m_profile:
+            profile = cProfile.Profile()
+            score = profile.runcall(self.m_search_engine.iterative_deepening, max_depth, ourColor, bestMove, bestMove,
+                                    time_budget)
+            # Keep stdout for the protocol
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(30)
+            print(stream.getvalue(), file=sys.stderr)
+        else:
+            score = self.m_search_engine.iterative_deepening(max_depth, ourColor, bestMove, bestMove, time_budget)
         end = time.perf_counter()
+        if self.m_stats:
+            SearchStats.write(self.m_search_engine.m_stats.report(end - start), self.m_stats_path)
 
-        print(f"==================================")
-        print(f"AB Time:\t{end - start:.3f}")
-        print(f"Node:\t{self.m_search_engine.m_total_nodes}\n")
-        print(f"Beta pod:\t{self.m_search_engine.m_beta_pod}\n")
-        print(f"Score:\t{self.m_best_move.score:.3f}")
-        print(f"BestMove:\t{bestMove}")
+        with self.m_output_lock:
+            print(f"==================================", file=self.m_output)
+            print(f"AB Time:\t{end - start:.3f}", file=self.m_output)
+            print(f"Depth:\t{self.m_search_engine.m_iterations[-1][0]}", file=self.m_output)
+            print(f"Node:\t{self.m_search_engine.m_total_nodes}\n", file=self.m_output)
+            print(f"Beta pod:\t{self.m_search_engine.m_beta_pod}\n", file=self.m_output)
+            print(f"Threat nodes:\t{self.m_search_engine.m_threat_search.m_total_nodes}", file=self.m_output)
+            print(f"Quiescence nodes:\t{self.m_search_engine.m_quiescence_nodes}", file=self.m_output)
+            print(f"Re-searches:\t{self.m_search_engine.m_researches}", file=self.m_output)
+            print(f"Reductions:\t{self.m_search_engine.m_reductions}", file=self.m_output)
+            print(f"Aspiration fails:\t{self.m_search_engine.m_aspiration_fails}", file=self.m_output)
+            result, line = self.m_search_engine.m_threat_result
+            if result == ThreatSearch.WIN:
+                print(f"Threat:\tproven win {' '.join(str(packed_to_move(move)) for move in line)}", file=self.m_output)
+            elif result == ThreatSearch.LOSS:
+                print(f"Threat:\tproven loss", file=self.m_output)
+            print(f"Score:\t{self.m_best_move.score:.3f}", file=self.m_output)
+            print(f"BestMove:\t{bestMove}", file=self.m_output)
         return True
 
-def flush_output():
-    sys.stdout.flush()
+    def start_ponder(self):
+        # Search the expected reply of the opponent in the background until its move comes
+        if not self.m_ponder or is_win_by_premove(self.m_board, self.m_best_move):
+            return
+        self.m_search_engine.m_stop = False
+        self.m_ponder_result = None
+        self.m_ponder_thread = threading.Thread(
+            target=self.ponder, args=(self.m_board[:], self.m_chess_type, StoneMove(list(self.m_best_move.positions))),
+            daemon=True)
+        self.m_ponder_thread.start()
+
+    def stop_ponder(self):
+        if self.m_ponder_thread is not None:
+            self.m_search_engine.m_stop = True
+            self.m_ponder_thread.join()
+            self.m_ponder_thread = None
+            self.m_search_engine.m_stop = False
+
+    def ponder(self, board, ourColor, ourMove):
+        # Background thread: guess the opponent's reply with a short search, then search our
+        # answer to it. Whatever happens, the transposition table keeps what was searched.
+        engine = self.m_search_engine
+        parallel, engine.m_parallel = engine.m_parallel, None  # The pool cannot be stopped early
+        try:
+            enemy = ourColor ^ 3
+            engine.before_search(board, enemy, Defines.PONDER_GUESS_DEPTH)
+            reply = StoneMove(list(ourMove.positions))
+            engine.iterative_deepening(Defines.PONDER_GUESS_DEPTH, enemy, reply, ourMove, float('inf'))
+            make_move(board, reply, enemy)
+            if engine.m_stop or is_win_by_premove(board, reply):
+                return
+            engine.before_search(board, ourColor, self.m_alphabeta_depth)
+            answer = StoneMove(list(reply.positions))
+            max_depth = Defines.MAX_DEPTH if self.time_budget() else self.m_alphabeta_depth
+            engine.iterative_deepening(max_depth, ourColor, answer, reply, float('inf'))
+            self.m_ponder_result = (board, answer, engine.m_iterations[-1][0])
+        finally:
+            engine.m_parallel = parallel
+
+    def book_move(self, ourColor, bestMove):
+        # Take the move of the opening book when it knows the position
+        if self.m_book is None:
+            return False
+        move = self.m_book.lookup(self.m_board, ourColor)
+        if move is None:
+            return False
+        bestMove.positions = move.positions
+        bestMove.score = move.score
+        return True
+
+    def set_book(self, path):
+        # Open the book file, "off" closes the current book
+        if self.m_book is not None:
+            self.m_book.close()
+            self.m_book = None
+        if path and path != "off":
+            try:
+                self.m_book = OpeningBook(path)
+            except (OSError, ValueError) as error:
+                print(f"No opening book: {error}", file=self.m_output)
+
+    def ponder_hit(self, bestMove):
+        # Take the pondered answer when the opponent played the guessed reply and the answer
+        # was searched to the full fixed depth. With a time budget the search runs again,
+        # and finds the pondered positions in the transposition table.
+        result, self.m_ponder_result = self.m_ponder_result, None
+        if result is None or self.time_budget():
+            return False
+        board, answer, depth = result
+        if board != self.m_board or depth < self.m_alphabeta_depth:
+            return False
+        bestMove.positions = list(answer.positions)
+        bestMove.score = answer.score
+        return True
+
+    def set_threads(self, threads):
+        # Use a pool of processes for the search, or a single process when threads is 1
+        threads = max(1, threads)
+        if self.m_search_engine.m_parallel is not None:
+            self.m_search_engine.m_parallel.close()
+            self.m_search_engine.m_parallel = None
+            self.m_search_engine.transposition_table = TranspositionTable()
+        if threads > 1:
+            parallel = ParallelSearch(threads)
+            self.m_search_engine.m_parallel = parallel
+            self.m_search_engine.transposition_table = parallel.transposition_table
+        self.m_threads = threads
+        # The timers wrap the methods of the table, which was replaced
+        self.m_search_engine.enable_stats(self.m_stats)
+
+    def bench(self, depth):
+        # Run the benchmark corpus with this engine's settings, the game is left as it was
+        report = bench.run_bench(depth, self.time_budget(), self.m_search_engine)
+        self.m_search_engine.transposition_table.clear()
+        print(json.dumps(report, indent=2), file=self.m_output)
+        self.m_output.flush()
+
+    def set_stats(self, arg):
+        # "on" reports on stderr, "off" stops, anything else is the file to append the reports to
+        self.m_stats = arg not in ("", "0", "off")
+        self.m_stats_path = arg if self.m_stats and arg not in ("1", "on") else None
+        self.m_search_engine.enable_stats(self.m_stats)
+
+    def time_budget(self):
+        # Seconds to spend on the next move, None to search at the fixed depth
+        budgets = []
+        if self.m_move_time:
+            budgets.append(self.m_move_time / 1000)
+        if self.m_time_left:
+            budgets.append(self.m_time_left / 1000 / Defines.TIMELEFT_MOVES)
+        return min(budgets) if budgets else None
+
+def non_negative(text, limit=None):
+    # Number argument of a command, up to limit when given. A ValueError answers the
+    # command with an error line.
+    value = int(text)
+    if value < 0 or limit is not None and value > limit:
+        raise ValueError(text)
+    return value
+
+def read_commands(commands):
+    # Reader thread: put every line of stdin on the queue, then None at the end of input
+    for line in sys.stdin:
+        commands.put(line.strip())
+    commands.put(None)
 
 # Create an instance of GameEngine and run the game
 if __name__ == "__main__":
@@ -1,4 +1,5 @@
 from game_engine import GameEngine
+import multiprocessing
 import sys
 
 def main():
@@ -6,4 +7,17 @@ def main():
     gameEngine.run()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Worker processes of the parallel search in a frozen executable
+    if sys.argv[1:2] == ["bench"]:
+        import bench
+        sys.exit(bench.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["analyze"]:
+        import analyze
+        sys.exit(analyze.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["server"]:
+        import engine_server
+        sys.exit(engine_server.main(sys.argv[2:]))
+    if sys.argv[1:2] == ["book"]:
+        import opening_book
+        sys.exit(opening_book.main(sys.argv[2:]))
     main()
@@ -0,0 +1,148 @@
+import argparse
+import mmap
+import struct
+import sys
+import time
+from tools import *
+from symmetry import canonical_hash, transform_move, INVERSE_SYMMETRY
+from transposition import pack_move, unpack_move, packed_to_move, move_to_packed
+from search_engine import SearchEngine
+
+# Opening book file: a header, then fixed-size entries sorted by canonical key, so a lookup
+# is a binary search in the memory-mapped file and opening the book reads nothing.
+# Moves are stored in the frame of the canonical image of the position.
+BOOK_MAGIC = b"C6BK"
+BOOK_VERSION = 1
+BOOK_HEADER = struct.Struct("<4sII")  # magic, version, number of entries
+BOOK_ENTRY = struct.Struct("<QIhH")  # canonical key, packed move, score, search depth
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.m_path = path
+        self.m_file = open(path, "rb")
+        try:
+            self.m_map = mmap.mmap(self.m_file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, self.m_count = BOOK_HEADER.unpack_from(self.m_map, 0)
+        except (ValueError, struct.error):
+            self.m_file.close()
+            raise ValueError(f"{path} is not an opening book")
+        if magic != BOOK_MAGIC or version != BOOK_VERSION \
+                or len(self.m_map) != BOOK_HEADER.size + self.m_count * BOOK_ENTRY.size:
+            self.close()
+            raise ValueError(f"{path} is not an opening book of version {BOOK_VERSION}")
+
+    def close(self):
+        self.m_map.close()
+        self.m_file.close()
+
+    def probe(self, key):
+        # (packed move, score, depth) stored for the canonical key, or None
+        low, high = 0, self.m_count
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, move, score, depth = BOOK_ENTRY.unpack_from(self.m_map, BOOK_HEADER.size +
+                                                                   middle * BOOK_ENTRY.size)
+            if entry_key == key:
+                return move, score, depth
+            if entry_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def lookup(self, board, color):
+        # Book move of color on the board as a StoneMove, or None when the position is not
+        # in the book. A move on an occupied cell means a key collision and is not played.
+        key, symmetry = canonical_hash(board, color)
+        entry = self.probe(key)
+        if entry is None:
+            return None
+        move, score, depth = entry
+        first, second = unpack_move(transform_move(move, INVERSE_SYMMETRY[symmetry]))
+        if first == second or board[first] != Defines.NOSTONE or board[second] != Defines.NOSTONE:
+            return None
+        bestMove = packed_to_move(pack_move(first, second))
+        bestMove.score = score
+        return bestMove
+
+
+def write_book(path, entries):
+    # Write the {canonical key: (packed move, score, depth)} entries as a book file
+    with open(path, "wb") as file:
+        file.write(BOOK_HEADER.pack(BOOK_MAGIC, BOOK_VERSION, len(entries)))
+        for key in sorted(entries):
+            move, score, depth = entries[key]
+            score = max(-0x8000, min(0x7FFF, round(score)))
+            file.write(BOOK_ENTRY.pack(key, move, score, depth))
+
+
+def likely_moves(engine, color, best, width):
+    # The best move and the pairs of the best first stones by static score, width at most,
+    # on engine's board
+    cells = engine.generate_moves(0)
+    gains = {cell: engine.evaluate_position(color, cell) for cell in cells}
+    cells.sort(key=lambda cell: -gains[cell])
+    top = cells[:width + 1]
+    pairs = sorted(((gains[first] + gains[second], pack_move(first, second))
+                    for i, first in enumerate(top) for second in top[i + 1:]), reverse=True)
+    moves = [best]
+    for score, move in pairs:
+        if len(moves) >= width:
+            break
+        if set(unpack_move(move)) != set(unpack_move(best)):
+            moves.append(move)
+    return moves
+
+
+def build_book(depth, plies, width, engine=None, log=None):
+    # Search the opening tree from the first black stone on JJ: every position gets its best
+    # move at the given depth, and its children are the width likely moves of the side to
+    # move, for plies moves. Positions equal up to a symmetry are searched once.
+    engine = engine or SearchEngine()
+    entries = {}
+    board = new_board()
+    first_move = msg2move("JJ")
+    make_move(board, first_move, Defines.BLACK)
+    frontier = [(board, Defines.WHITE, first_move)]
+    for ply in range(plies):
+        next_frontier = []
+        for board, color, preMove in frontier:
+            key, symmetry = canonical_hash(board, color)
+            if key in entries:
+                continue
+            start = time.perf_counter()
+            bestMove = engine.search(board, color, preMove, depth)
+            score = bestMove.score
+            best = move_to_packed(bestMove)
+            entries[key] = (transform_move(best, symmetry), score, depth)
+            if log:
+                log(f"ply {ply + 1} {len(entries)} positions, {bestMove} {score:.2f} "
+                    f"in {time.perf_counter() - start:.2f}s")
+            if abs(score) >= Defines.MAXINT:
+                continue  # Decided, nothing to learn from the children
+            for move in likely_moves(engine, color, best, width):
+                child = board[:]
+                childMove = packed_to_move(move)
+                make_move(child, childMove, color)
+                next_frontier.append((child, color ^ 3, childMove))
+        frontier = next_frontier
+    return entries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="book", description="Build an opening book by searching the opening tree.")
+    parser.add_argument("--output", default=Defines.BOOK_FILE, help="book file to write")
+    parser.add_argument("--depth", type=int, default=3, help="search depth of every book position")
+    parser.add_argument("--plies", type=int, default=3, help="moves from the first black stone")
+    parser.add_argument("--width", type=int, default=3, help="moves followed in every position")
+    args = parser.parse_args(argv)
+
+    entries = build_book(args.depth, args.plies, args.width, log=lambda msg: print(msg, file=sys.stderr))
+    write_book(args.output, entries)
+    print(f"{len(entries)} positions written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
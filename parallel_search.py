@@ -0,0 +1,161 @@
+import multiprocessing
+from multiprocessing import shared_memory
+from tools import *
+from search_engine import SearchEngine, SearchTimeout
+from transposition import TranspositionTable
+
+PARALLEL_POLL_TIME = 0.05  # Seconds between two looks at the stop flag while the workers search
+
+
+class ParallelSearch:
+    # Root-parallel search over a process pool. The first stones of the root are split
+    # between the workers, which all use one transposition table in shared memory.
+    # The previous best first stone is searched alone first so that the other workers
+    # start with its score as alpha (young brothers wait), and the results are merged in
+    # root order so the chosen move does not depend on which worker finished first.
+    # A task only reads the shared table and keeps what it stores apart, see _TaskTable;
+    # its entries are written to the shared table when its round is merged. So no task
+    # sees what a sibling is storing at the same moment, and the same position searched
+    # with the same number of workers gives the same move. It may still differ from the
+    # move of one process, whose first stones see the entries of all the earlier ones.
+    # The workers are started by a fork server, or spawned, rather than forked from the
+    # engine: a fork copies the locks held by its other threads, such as the stdin buffer
+    # lock of the command reader, and the workers would hang on them.
+
+    def __init__(self, threads, size_bits=Defines.TT_SIZE_BITS):
+        self.m_threads = threads
+        self.m_memory = shared_memory.SharedMemory(create=True, size=TranspositionTable.buffer_size(size_bits))
+        self.transposition_table = TranspositionTable(size_bits, self.m_memory.buf)
+        self.transposition_table.clear()
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self.m_stop_flag = context.RawValue('b', 0)  # Set to stop the workers' searches
+        self.m_pool = context.Pool(threads, initializer=_init_worker,
+                                   initargs=(self.m_memory.name, size_bits, self.m_stop_flag))
+
+    def close(self):
+        self.m_pool.terminate()
+        self.m_pool.join()
+        # The table's views must be released before the shared memory can be closed
+        self.transposition_table.m_keys.release()
+        self.transposition_table.m_data.release()
+        self.transposition_table.m_buffer.release()
+        self.m_memory.close()
+        self.m_memory.unlink()
+
+    def search_root(self, engine, depth, ourColor, preMove):
+        # One iteration of engine's iterative deepening at the given depth from the packed last
+        # move. Leaves the best move in engine.m_best_packed and returns the score, raises
+        # SearchTimeout when a worker ran out of time or engine.m_stop was set.
+        cells = engine.generate_moves(preMove, ourColor)
+        # Previous best move first, then the first stones by their static score
+        cells.sort(key=lambda cell: -engine.evaluate_position(ourColor, cell))
+        if engine.m_root_move:
+            engine.order_tt_move(cells, engine.m_root_move)
+        board = bytes(engine.m_board)
+
+        def task(first, alpha):
+            return board, ourColor, depth, alpha, preMove, cells, first, engine.m_deadline, engine.options()
+
+        self.m_stop_flag.value = 0
+        results = [self.wait(engine, self.m_pool.apply_async(_search_first_stone, (task(cells[0], Defines.MININT),)))]
+        self.merge(engine, results)
+        alpha = results[0][0]
+        rest = self.wait(engine, self.m_pool.map_async(_search_first_stone, [task(first, alpha) for first in cells[1:]],
+                                                       chunksize=1))
+        self.merge(engine, rest)
+        results += rest
+
+        best_score = float('-inf')
+        best_move = 0
+        for result in results:
+            # Strictly better only, so ties go to the first stone earlier in root order
+            if result[0] > best_score:
+                best_score = result[0]
+                best_move = result[1]
+        engine.m_best_packed = best_move
+        return best_score
+
+    @staticmethod
+    def merge(engine, results):
+        # Store the entries of the tasks in the shared table, in root order, and add their
+        # counters to the engine's. Raise SearchTimeout when one of them ran out of time or
+        # was stopped: the iteration is then lost, and the tasks after a stopped first stone
+        # are not even started.
+        table = engine.transposition_table
+        for score, move, counters, entries in results:
+            engine.add_counters(counters)
+            for key, entry in entries.items():
+                table.store(key, *entry)
+        if any(result[0] is None for result in results):
+            raise SearchTimeout()
+
+    def wait(self, engine, result):
+        # Result of an asynchronous call to the pool. Meanwhile a stop of the engine is passed
+        # on to the workers, whose searches end at their next clock check.
+        while not result.ready():
+            result.wait(PARALLEL_POLL_TIME)
+            if engine.m_stop:
+                self.m_stop_flag.value = 1
+        return result.get()
+
+
+class _TaskTable:
+    # Transposition table of a root task in a worker: entries are looked up in the task's own
+    # first, then in the shared table, which the task never writes. Scores are rounded and
+    # clamped like the shared table does, so the task reads the values it will store there.
+
+    def __init__(self, shared):
+        self.m_shared = shared
+        self.m_entries = {}  # key: (score, depth, flag, move) stored by the task
+
+    def probe(self, key):
+        entry = self.m_entries.get(key)
+        return entry if entry is not None else self.m_shared.probe(key)
+
+    def store(self, key, score, depth, flag, move):
+        score = max(-TranspositionTable.SCORE_LIMIT, min(TranspositionTable.SCORE_LIMIT, score))
+        score = round(score * TranspositionTable.SCORE_SCALE) / TranspositionTable.SCORE_SCALE
+        old = self.m_entries.get(key)
+        if move == 0 and old is not None:
+            move = old[3]  # Keep the old best move if the new entry has none
+        self.m_entries[key] = (score, depth, flag, move)
+
+
+class _StopFlag:
+    # Stands for m_stop in a worker's engine: true once the shared flag is set
+    def __init__(self, value):
+        self.m_value = value
+
+    def __bool__(self):
+        return self.m_value.value != 0
+
+
+def _init_worker(memory_name, size_bits, stop_flag):
+    memory = shared_memory.SharedMemory(name=memory_name)
+    engine = SearchEngine.init_worker(TranspositionTable(size_bits, memory.buf))
+    engine.m_shared_memory = memory  # Keep the block mapped while the worker lives
+    engine.m_shared_table = engine.transposition_table  # Read by the tasks, see _TaskTable
+    engine.m_stop = _StopFlag(stop_flag)
+
+
+def _search_first_stone(args):
+    # Search all the moves starting with one first stone, in a worker process
+    board, ourColor, depth, alpha, preMove, cells, first, deadline, options = args
+    engine = SearchEngine.m_worker
+    engine.transposition_table = _TaskTable(engine.m_shared_table)
+    engine.set_options(options)
+    engine.set_board(bytearray(board))
+    # The beams follow the history, which must not depend on the tasks this worker ran before
+    engine.clear_move_ordering()
+    engine.reset_counters()
+    engine.m_deadline = deadline
+    engine.m_root_cells = cells
+    engine.m_root_firsts = [first]
+    engine.m_best_packed = 0
+    try:
+        score = engine.alpha_beta_search(depth, alpha, Defines.MAXINT, ourColor, preMove)
+        packed = engine.m_best_packed
+    except SearchTimeout:
+        score, packed = None, 0
+    return score, packed, engine.counters(), engine.transposition_table.m_entries
@@ -0,0 +1,119 @@
+from itertools import compress
+from tools import *
+
+# Pattern evaluation. The board is covered by every window of WINDOW_SIZE consecutive
+# cells along the four line directions that lies inside the border. Each window is
+# encoded as a base-3 integer (digit k is the stone on its k-th cell: 0 empty, 1 black,
+# 2 white), which indexes the tables below. Placing a stone only changes the windows
+# through its cell, so the evaluation is updated incrementally.
+
+WINDOW_SIZE = 6
+PATTERN_COUNT = 3 ** WINDOW_SIZE  # Number of window codes.
+
+# Threat classes of a window, by stones of its owner. A window holding stones of both
+# colors is dead and can never become a six. Live windows with THREAT_STONES or more
+# stones are threats: the opponent has to put a stone in the window or lose.
+THREAT_STONES = 4
+# Live windows with HOT_STONES or more stones can become threats with one move. Their number
+# per color is kept in one int, black in the low bits and white counted by HOT_WHITE. The same
+# int counts the full windows, six in a row, of black by SIX_BLACK and of white by SIX_WHITE,
+# so a win is seen without walking the lines. Every count has 10 bits.
+HOT_STONES = 3
+HOT_WHITE = 1 << 10
+SIX_BLACK = 1 << 20
+SIX_WHITE = 1 << 30
+# Score of a live window by the number of stones of its owner, six is a win.
+WINDOW_SCORE = (0, 1, 10, 50, 200, 500, 10000)
+CENTER_BONUS = 10
+
+
+def _build_windows():
+    windows = []
+    last = Defines.GRID_NUM - 2
+    for dx, dy in ((1, 0), (0, 1), (1, 1), (-1, 1)):
+        for x in range(1, last + 1):
+            for y in range(1, last + 1):
+                end_x, end_y = x + dx * (WINDOW_SIZE - 1), y + dy * (WINDOW_SIZE - 1)
+                if 1 <= end_x <= last and 1 <= end_y <= last:
+                    windows.append(tuple(cell_index(x + dx * k, y + dy * k) for k in range(WINDOW_SIZE)))
+    return tuple(windows)
+
+
+def _build_tables():
+    owner_table = bytearray(PATTERN_COUNT)
+    count_table = bytearray(PATTERN_COUNT)
+    score_table = [0] * PATTERN_COUNT
+    hot_table = [0] * PATTERN_COUNT
+    for code in range(PATTERN_COUNT):
+        digits = [(code // 3 ** k) % 3 for k in range(WINDOW_SIZE)]
+        black, white = digits.count(Defines.BLACK), digits.count(Defines.WHITE)
+        if black and white:
+            continue  # Dead window
+        if black:
+            owner_table[code], count_table[code] = Defines.BLACK, black
+            score_table[code] = WINDOW_SCORE[black]
+            hot_table[code] = (1 if black >= HOT_STONES else 0) + (SIX_BLACK if black == WINDOW_SIZE else 0)
+        elif white:
+            owner_table[code], count_table[code] = Defines.WHITE, white
+            score_table[code] = -WINDOW_SCORE[white]
+            hot_table[code] = (HOT_WHITE if white >= HOT_STONES else 0) + (SIX_WHITE if white == WINDOW_SIZE else 0)
+    return bytes(owner_table), bytes(count_table), tuple(score_table), tuple(hot_table)
+
+
+# WINDOWS[w] is the tuple of the cells of window w.
+WINDOWS = _build_windows()
+# CELL_WINDOWS[cell] is a tuple of (window, 3 ** position of the cell in the window).
+CELL_WINDOWS = [[] for _ in range(Defines.GRID_CELLS)]
+for _w, _cells in enumerate(WINDOWS):
+    for _k, _cell in enumerate(_cells):
+        CELL_WINDOWS[_cell].append((_w, 3 ** _k))
+CELL_WINDOWS = tuple(tuple(windows) for windows in CELL_WINDOWS)
+# PATTERN_OWNER[code] and PATTERN_STONES[code]: owner color and number of stones of a live
+# window, NOSTONE/0 for empty and dead ones. PATTERN_SCORE[code]: score for black.
+# PATTERN_HOT[code]: contribution of the window to the packed count of hot and full windows.
+PATTERN_OWNER, PATTERN_STONES, PATTERN_SCORE, PATTERN_HOT = _build_tables()
+# Bonus for being closer to the center of the board, per cell.
+CENTER_SCORE = tuple(CENTER_BONUS / (1 + ((x - 10) ** 2 + (y - 10) ** 2) ** 0.5)
+                     for x, y in (divmod(cell, Defines.GRID_NUM) for cell in range(Defines.GRID_CELLS)))
+
+
+# _LIVE_TABLES[color][k][code] is 1 when the window code is live for color with at least k stones.
+_LIVE_TABLES = [None] + [[bytes(1 if PATTERN_OWNER[code] == color and PATTERN_STONES[code] >= k else 0
+                                for code in range(PATTERN_COUNT)) for k in range(WINDOW_SIZE + 1)]
+                         for color in (Defines.BLACK, Defines.WHITE)]
+
+
+def live_windows(codes, color, min_stones):
+    # Windows that are live for color and hold at least min_stones of its stones.
+    return list(compress(range(len(codes)), map(_LIVE_TABLES[color][min_stones].__getitem__, codes)))
+
+
+def window_codes(board):
+    # Code of every window of the board, computed from scratch.
+    codes = []
+    for cells in WINDOWS:
+        code = 0
+        for k, cell in enumerate(cells):
+            code += board[cell] * 3 ** k
+        codes.append(code)
+    return codes
+
+
+def evaluate_board(codes):
+    # Static score of the board for black, the sum of the window scores.
+    return sum(PATTERN_SCORE[code] for code in codes)
+
+
+def count_hot(codes):
+    # Packed count of hot and full windows, see HOT_WHITE.
+    return sum(PATTERN_HOT[code] for code in codes)
+
+
+def hot_windows(hot, color):
+    # Number of hot windows of color in a packed count.
+    return hot & (HOT_WHITE - 1) if color == Defines.BLACK else (hot // HOT_WHITE) & (HOT_WHITE - 1)
+
+
+def six_windows(hot, color):
+    # Number of full windows of color in a packed count, non-zero when color has six in a row.
+    return (hot // SIX_BLACK) & (HOT_WHITE - 1) if color == Defines.BLACK else hot // SIX_WHITE
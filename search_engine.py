@@ -1,89 +1,444 @@
-import hashlib
+import time
 from tools import *
+from transposition import *
+from patterns import *
+from threat_search import ThreatSearch
+from search_stats import SearchStats
+from vector_scoring import VECTOR_SCORING, VECTOR_MIN_CELLS, score_cells
+from symmetry import SYMMETRY_STONE_KEYS, INVERSE_SYMMETRY, symmetry_hashes, canonical_key, transform_move
+
+
+class SearchTimeout(Exception):
+    # Raised inside alpha_beta_search when the deadline of the search is reached
+    pass
 
 
 class SearchEngine:
-    def __init__(self):
+    m_worker = None  # Engine of this process when it is a pool worker, see init_worker
+    # Report name and attribute of the counters of a search, see counters. The nodes of the
+    # threat-space search are counted by the solver, as threat_nodes.
+    COUNTERS = (
+        ("nodes", "m_total_nodes"),
+        ("beta_cutoffs", "m_beta_pod"),
+        ("first_pair_cutoffs", "m_beta_first"),
+        ("tt_probes", "m_tt_probes"),
+        ("tt_hits", "m_tt_hits"),
+        ("quiescence_nodes", "m_quiescence_nodes"),
+        ("researches", "m_researches"),
+        ("reductions", "m_reductions"),
+        ("aspiration_fails", "m_aspiration_fails"),
+    )
+    # Search options set by the commands of the game engine, passed on to the worker processes
+    OPTIONS = ("m_symmetric", "m_aspiration_window", "m_lmr_reduction", "m_quiescence_depth")
+
+    def __init__(self, transposition_table=None):
         self.m_board = None  # The game board
         self.m_chess_type = None  # The type of chess piece (black or white)
         self.m_alphabeta_depth = None  # Depth for the alpha-beta pruning
         self.m_total_nodes = 0  # Total nodes explored
         self.m_beta_pod = 0  # Beta cutoffs count
-        self.transposition_table = {}  # Hash table for storing board positions
+        self.m_tt_probes = 0  # Transposition table lookups
+        self.m_tt_hits = 0  # Lookups that found the position
+        self.m_hash = 0  # Zobrist key of m_board, updated by make_move/unmake_move
+        # Keys of the 8 symmetric images of m_board when positions equal up to a symmetry share
+        # their transposition table entries, None when they do not
+        self.m_symmetry_hashes = None
+        self.m_symmetric = Defines.TT_SYMMETRY
+        self.m_vector_scoring = VECTOR_SCORING  # Score candidate cells with NumPy, see vector_scoring.py
+        self.m_second_stones = Defines.SECOND_STONE_LIMIT  # Second stones searched per first stone, 0 for all
+        self.m_first_stones = Defines.FIRST_STONE_LIMIT  # First stones searched below the root, 0 for all
+        # Two packed pairs per ply made cutoffs, with room for the threat extension below the leaves
+        self.m_killers = [[0, 0] for _ in range(2 * Defines.MAX_DEPTH + 1)]
+        self.m_history = [[0] * Defines.GRID_CELLS for _ in range(3)]  # Per color and cell, credit of cutoffs
+        self.m_beta_first = 0  # Cutoffs made by the first pair tried
+        self.m_aspiration_window = Defines.ASPIRATION_WINDOW  # Root window around the last score, 0 for none
+        self.m_lmr_reduction = Defines.LMR_REDUCTION  # Plies taken off the late pairs, 0 for none
+        self.m_quiescence_depth = Defines.QUIESCENCE_DEPTH  # Moves of the threat extension at the leaves
+        self.m_researches = 0  # Pairs searched again after a null window or reduced search failed high
+        self.m_reductions = 0  # Pairs searched at a reduced depth
+        self.m_aspiration_fails = 0  # Root searches repeated with a wider window
+        self.m_quiescence_nodes = 0  # Nodes of the threat extension, also counted in m_total_nodes
+        self.m_candidate_radius = Defines.CANDIDATE_RADIUS  # Candidates are empty cells this close to a stone
+        self.m_last_move_radius = Defines.LAST_MOVE_RADIUS  # Extra radius around the stones of the last move
+        self.m_near_stone = None  # Neighbour cells within m_candidate_radius, per cell
+        self.m_candidate_count = None  # Per cell, number of stones within m_candidate_radius
+        self.m_candidates = set()  # Empty cells with a non-zero m_candidate_count
+        self.m_codes = None  # Pattern code of every window, see patterns.py
+        self.m_eval = 0  # Static score of m_board for black, sum of the window scores
+        self.m_hot = 0  # Packed count of hot and full windows of both colors, see patterns.HOT_WHITE
+        self.m_threat_search = ThreatSearch(self)  # Forcing-win solver run before and below the search
+        self.m_threat_result = (ThreatSearch.UNKNOWN, [])  # Result of the solver at the root
+        # Bounded table of searched positions, may be shared with other processes
+        self.transposition_table = transposition_table if transposition_table is not None else TranspositionTable()
+        self.m_parallel = None  # ParallelSearch splitting the root over processes, None for one process
+        self.m_root_cells = None  # Root cells given by a root split, None to generate them
+        self.m_root_firsts = None  # First stones this process searches at the root of a split
+        self.m_deadline = None  # perf_counter() time at which the search stops, None for no limit
+        self.m_stop = False  # Set from another thread to stop the search at the next clock check
+        self.m_root_move = 0  # Packed best move of the last completed iteration, searched first
+        self.m_best_packed = 0  # Packed best move of the last root searched
+        self.m_iterations = []  # (depth, score, nodes, seconds, move) of every completed iteration
+        self.m_stats = None  # SearchStats timing the phases of the search, None when off
+
+    @classmethod
+    def init_worker(cls, transposition_table=None):
+        # Pool initializer: the engine the tasks of this worker process search with
+        cls.m_worker = cls(transposition_table)
+        return cls.m_worker
+
+    def search(self, board, ourColor, lastMove, depth, time_budget=None):
+        # Search the move of ourColor on the board after the opponent's lastMove, to the fixed
+        # depth or, with a time budget in seconds, by iterative deepening until it runs out.
+        # Returns the best move as a new StoneMove with its score. A stop of an earlier search
+        # does not end this one.
+        self.m_stop = False
+        self.before_search(board, ourColor, depth)
+        bestMove = StoneMove(list(lastMove.positions))
+        bestMove.score = self.iterative_deepening(Defines.MAX_DEPTH if time_budget else depth, ourColor, bestMove,
+                                                  lastMove, time_budget)
+        return bestMove
 
     def before_search(self, board, color, alphabeta_depth):
         # Initialize the search engine with the current state of the game
-        self.m_board = [row[:] for row in board]  # Clone the board
+        if self.m_stats is not None:
+            self.m_stats.reset()
+        self.set_board(board)
         self.m_chess_type = color  # Set the current player's color
         self.m_alphabeta_depth = alphabeta_depth  # Set the search depth
-        self.m_total_nodes = 0  # Reset the total nodes explored
-        self.m_beta_pod = 0  # Reset beta cutoffs
-        self.transposition_table = {}
+        self.reset_counters()
+        for killers in self.m_killers:
+            killers[:] = (0, 0)
+        # The history of older searches still counts, but less
+        for history in self.m_history:
+            history[:] = [credit >> 1 for credit in history]
+        self.m_deadline = None
+        self.m_root_move = 0
+        self.m_best_packed = 0
+        self.m_iterations = []
+        self.m_threat_result = (ThreatSearch.UNKNOWN, [])
+        # Keep the table of the previous searches, its entries are still valid
+        self.transposition_table.new_search()
+
+    def reset_counters(self):
+        # Zero the counters before a search, see COUNTERS
+        for name, attribute in SearchEngine.COUNTERS:
+            setattr(self, attribute, 0)
+        self.m_threat_search.m_total_nodes = 0
+
+    def counters(self):
+        # The counters of the search by report name
+        counters = {name: getattr(self, attribute) for name, attribute in SearchEngine.COUNTERS}
+        counters["threat_nodes"] = self.m_threat_search.m_total_nodes
+        return counters
+
+    def add_counters(self, counters):
+        # Add the counters of another search, such as a root task searched by a worker
+        for name, attribute in SearchEngine.COUNTERS:
+            setattr(self, attribute, getattr(self, attribute) + counters[name])
+        self.m_threat_search.m_total_nodes += counters["threat_nodes"]
+
+    def options(self):
+        # The search options by attribute, see OPTIONS
+        return {attribute: getattr(self, attribute) for attribute in SearchEngine.OPTIONS}
+
+    def set_options(self, options):
+        # Take the options of another engine before its search, such as the one of a worker
+        for attribute, value in options.items():
+            setattr(self, attribute, value)
+
+    def clear_move_ordering(self):
+        # Forget the killers and the history, so the next search does not depend on the
+        # searches run before it
+        for killers in self.m_killers:
+            killers[:] = (0, 0)
+        for history in self.m_history:
+            history[:] = [0] * Defines.GRID_CELLS
+
+    def enable_stats(self, enabled):
+        # Turn the phase timers on or off, see SearchStats
+        if self.m_stats is not None:
+            self.m_stats.disable()
+            self.m_stats = None
+        if enabled:
+            self.m_stats = SearchStats(self)
+            self.m_stats.enable()
+
+    def set_symmetry(self, enabled):
+        # Share the transposition table entries of symmetric positions or not. The entries
+        # stay valid either way: a canonical key is the plain key of the canonical image,
+        # and moves are stored in the frame of the position the key belongs to.
+        self.m_symmetric = enabled
+        if self.m_board is not None:
+            self.m_symmetry_hashes = symmetry_hashes(self.m_board) if enabled else None
+
+    def set_board(self, board):
+        # Clone the board, a single buffer copy, and rebuild the incremental state from it
+        self.m_board = board[:]
+        self.m_hash = self.hash_board()
+        self.m_symmetry_hashes = symmetry_hashes(self.m_board) if self.m_symmetric else None
+        self.init_candidates()
+        self.m_codes = window_codes(self.m_board)
+        self.m_eval = evaluate_board(self.m_codes)
+        self.m_hot = count_hot(self.m_codes)
 
     def hash_board(self):
-        """ Generate a unique hash for the current board position. """
-        return hashlib.sha256(str(self.m_board).encode()).hexdigest()
-
-    def alpha_beta_search(self, depth, alpha, beta, ourColor, bestMove, preMove):
-        # Alpha-beta pruning search algorithm
+        """ Compute the Zobrist key of the current board from scratch. """
+        return zobrist_hash(self.m_board)
+
+    def init_candidates(self):
+        # Build the reference counts of the candidate set from the whole board
+        board = self.m_board
+        self.m_near_stone = neighbour_cells(self.m_candidate_radius)
+        self.m_candidate_count = [0] * Defines.GRID_CELLS
+        for cell, stone in enumerate(board):
+            if stone == Defines.BLACK or stone == Defines.WHITE:
+                for near in self.m_near_stone[cell]:
+                    self.m_candidate_count[near] += 1
+        self.m_candidates = {cell for cell, count in enumerate(self.m_candidate_count)
+                             if count and board[cell] == Defines.NOSTONE}
+
+    def place_stone(self, cell, color):
+        # Put a single stone on the board, update the Zobrist key, the candidate set and the
+        # windows through the cell. Returns the change of the static score for black.
+        self.m_board[cell] = color
+        self.m_hash ^= ZOBRIST_KEYS[color][cell]
+        if self.m_symmetry_hashes is not None:
+            self.m_symmetry_hashes = [key ^ image for key, image in
+                                      zip(self.m_symmetry_hashes, SYMMETRY_STONE_KEYS[color][cell])]
+        codes = self.m_codes
+        delta = 0
+        hot = 0
+        for w, power in CELL_WINDOWS[cell]:
+            code = codes[w]
+            codes[w] = code + color * power
+            delta += PATTERN_SCORE[code + color * power] - PATTERN_SCORE[code]
+            hot += PATTERN_HOT[code + color * power] - PATTERN_HOT[code]
+        self.m_eval += delta
+        self.m_hot += hot
+        candidate_count = self.m_candidate_count
+        candidates = self.m_candidates
+        candidates.discard(cell)
+        for near in self.m_near_stone[cell]:
+            candidate_count[near] += 1
+            if candidate_count[near] == 1 and self.m_board[near] == Defines.NOSTONE:
+                candidates.add(near)
+        return delta
+
+    def remove_stone(self, cell):
+        # Take a single stone off the board, update the Zobrist key, the candidate set and
+        # the windows through the cell
+        color = self.m_board[cell]
+        self.m_hash ^= ZOBRIST_KEYS[color][cell]
+        if self.m_symmetry_hashes is not None:
+            self.m_symmetry_hashes = [key ^ image for key, image in
+                                      zip(self.m_symmetry_hashes, SYMMETRY_STONE_KEYS[color][cell])]
+        self.m_board[cell] = Defines.NOSTONE
+        codes = self.m_codes
+        delta = 0
+        hot = 0
+        for w, power in CELL_WINDOWS[cell]:
+            code = codes[w]
+            codes[w] = code - color * power
+            delta += PATTERN_SCORE[code - color * power] - PATTERN_SCORE[code]
+            hot += PATTERN_HOT[code - color * power] - PATTERN_HOT[code]
+        self.m_eval += delta
+        self.m_hot += hot
+        candidate_count = self.m_candidate_count
+        candidates = self.m_candidates
+        for near in self.m_near_stone[cell]:
+            candidate_count[near] -= 1
+            if candidate_count[near] == 0:
+                candidates.discard(near)
+        if candidate_count[cell]:
+            candidates.add(cell)
+
+    def make_move(self, move, color):
+        # Incremental version of tools.make_move on a packed move, a move with two equal cells
+        # is one stone
+        first, second = unpack_move(move)
+        self.place_stone(first, color)
+        if second != first:
+            self.place_stone(second, color)
+
+    def unmake_move(self, move):
+        # Incremental version of tools.unmake_move on a packed move
+        first, second = unpack_move(move)
+        self.remove_stone(first)
+        if second != first:
+            self.remove_stone(second)
+
+    def alpha_beta_search(self, depth, alpha, beta, ourColor, preMove, ply=0, qdepth=None):
+        # Principal variation search, fail-soft. preMove is the packed last move of the
+        # opponent, the best move of the root is left in m_best_packed. qdepth is the number of
+        # threat extensions left for the leaves, m_quiescence_depth when None.
         self.m_total_nodes += 1  # Increment total nodes explored
-
-        # Generate a hash for the current board state
-        board_hash = self.hash_board()
-
-        # Check if the result of this position is already computed
-        if board_hash in self.transposition_table and self.transposition_table[board_hash]['depth'] >= depth:
-            return self.transposition_table[board_hash]['score']
+        if qdepth is None:
+            qdepth = self.m_quiescence_depth
+
+        # Check the clock and the stop flag every TIME_CHECK_NODES + 1 nodes
+        if self.m_deadline is not None and not self.m_total_nodes & Defines.TIME_CHECK_NODES \
+                and (self.m_stop or time.perf_counter() >= self.m_deadline):
+            raise SearchTimeout()
+
+        # The side to move is part of the key. With symmetric entries the key is the one of the
+        # canonical image of the board, and the moves are stored in the frame of that image.
+        if self.m_symmetry_hashes is None:
+            board_hash = self.m_hash ^ ZOBRIST_SIDE if ourColor == Defines.WHITE else self.m_hash
+            symmetry = 0
+        else:
+            board_hash, symmetry = canonical_key(self.m_symmetry_hashes, ourColor)
+        alpha_orig = alpha
+
+        # Check if the result of this position is already computed. The root always searches
+        # so that m_best_packed gets filled.
+        tt_move = self.m_root_move if ply == 0 else 0
+        entry = self.transposition_table.probe(board_hash)
+        self.m_tt_probes += 1
+        if entry is not None:
+            self.m_tt_hits += 1
+            tt_score, tt_depth, tt_flag, tt_move = entry
+            if tt_move and symmetry:
+                tt_move = transform_move(tt_move, INVERSE_SYMMETRY[symmetry])
+            if ply == 0 and self.m_root_move:
+                tt_move = self.m_root_move  # The previous iteration's best move goes first
+            elif ply > 0 and tt_depth >= depth:
+                if tt_flag == TranspositionTable.EXACT:
+                    return tt_score
+                if tt_flag == TranspositionTable.LOWER and tt_score >= beta:
+                    return tt_score
+                if tt_flag == TranspositionTable.UPPER and tt_score <= alpha:
+                    return tt_score
 
         # Check for the first move
         if self.check_first_move():
             # Set a default move if it's the first move
-            bestMove.positions[0].x = 10
-            bestMove.positions[0].y = 10
-            bestMove.positions[1].x = 10
-            bestMove.positions[1].y = 10
+            self.m_best_packed = pack_move(cell_index(10, 10), cell_index(10, 10))
             return Defines.MAXINT
 
-        # Check if the pre-move is a winning move
-        if is_win_by_premove(self.m_board, preMove):
-            return Defines.MAXINT
-
-        # Generate possible moves for the first stone
-        move_possibilities = self.generate_moves(bestMove)
+        # Check if the pre-move of the opponent is a winning move: a six of the opponent can only
+        # come from its last move, and the count of full windows is kept by place_stone
+        if six_windows(self.m_hot, 3 - ourColor):
+            return Defines.MININT
+
+        # At the leaves, a short threat-space search finds the forced wins and losses that
+        # the static evaluation misses. It only runs when there are windows to attack from.
+        if depth == 1 and ply > 0 and (hot_windows(self.m_hot, ourColor) >= 2
+                                       or hot_windows(self.m_hot, 3 - ourColor) >= 3):
+            result, line = self.m_threat_search.solve(ourColor, Defines.THREAT_LEAF_DEPTH,
+                                                      Defines.THREAT_LEAF_NODES, self.m_deadline)
+            if result == ThreatSearch.WIN:
+                return Defines.MAXINT
+            if result == ThreatSearch.LOSS:
+                return Defines.MININT
+
+        # Generate possible moves for the first stone. When the root is split over processes,
+        # the root cells and the first stones of this process are given.
+        threat_cells = None
+        if ply == 0 and self.m_root_cells is not None:
+            move_possibilities = self.m_root_cells
+            first_stones = self.m_root_firsts
+            forced = {}
+        else:
+            move_possibilities = self.order_cells(ourColor, self.generate_moves(preMove, ourColor))
+            # The stored best move and the killers of this ply are tried first, the other first
+            # stones by their order, cut to the beam below the root
+            forced = self.forced_pairs(tt_move, ply, move_possibilities)
+            first_stones = list(forced)
+            if ply > 0 and self.m_first_stones and len(move_possibilities) > self.m_first_stones:
+                threat_cells = self.threat_cells()
+                first_stones += [cell for k, cell in enumerate(move_possibilities) if cell not in forced and (
+                    k < self.m_first_stones or cell in threat_cells)]
+            else:
+                first_stones += [cell for cell in move_possibilities if cell not in forced]
+
+        # Below the root, the pairs after the first LMR_FULL_PAIRS are searched at a reduced
+        # depth, except the stored and killer pairs and those making or blocking threats. Nothing
+        # is reduced while the opponent has hot windows: any quiet pair may lose to them.
+        reduce = ply > 0 and self.m_lmr_reduction and depth >= Defines.LMR_MIN_DEPTH \
+            and not hot_windows(self.m_hot, 3 - ourColor)
+        if reduce and threat_cells is None:
+            threat_cells = self.threat_cells()
 
         best_score = float('-inf')
+        sign = 1 if ourColor == Defines.BLACK else -1  # Turns black scores into ourColor scores
         best_position_first = None
         best_position_second = None
+        searched = set()  # Pairs searched, smaller cell first: (a, b) and (b, a) are the same move
+        if ply == 0 and self.m_root_cells is not None:
+            # In a root split, the pairs with a first stone earlier in root order are searched
+            # by the task of that stone
+            for position_first in first_stones:
+                for earlier in move_possibilities[:move_possibilities.index(position_first)]:
+                    searched.add(pack_move(min(position_first, earlier), max(position_first, earlier)))
+        tried = 0  # Pairs tried, to count the cutoffs of the first one
 
         # Search for the best move for the first stone
-        # evaluated_moves = set()  # Set to store evaluated positions of the first stone
-        for position_first in move_possibilities:
-            # Create a temporary move with the first stone
-            tempMove = StoneMove([position_first, position_first])
-            make_move(self.m_board, tempMove, ourColor)
-            # Evaluate the board position after placing the first stone
-            score_first = self.evaluate_position(ourColor, position_first)
+        for position_first in first_stones:
+            # Place the first stone, its score is the change of the static evaluation
+            score_first = sign * self.place_stone(position_first, ourColor) + CENTER_SCORE[position_first]
+
+            if depth > 1:
+                second_stones = forced.get(position_first, []) + self.second_stones(ourColor, move_possibilities)
+            else:
+                # At the last level only the best second stone counts, looked up in the pattern tables
+                position_second, leaf_gain = self.best_second_stone(ourColor, move_possibilities)
+                second_stones = (position_second,) if position_second is not None else ()
 
             # Search for the best move for the second stone
-            for position_second in move_possibilities:
+            for position_second in second_stones:
                 if position_second == position_first:
                     continue  # Skip if it's the same as the first position
 
-                # Add the second stone and evaluate the board position
-                tempMove = StoneMove([position_first, position_second])
-
-                make_move(self.m_board, tempMove, ourColor)
-                score_second = self.evaluate_position(ourColor, position_second)
-
-                # Recursive call for the next depth level
                 if depth > 1:
-                    # Adjust score based on the minimax search for the next level
-                    score_second -= self.alpha_beta_search(depth - 1, -beta, -alpha, 3 - ourColor, bestMove, tempMove)
-                    # else:
-                    #  print_board(self.m_board)
-                total_score = score_first + score_second
-                # Revert the move after evaluation
-                unmake_move(self.m_board, tempMove)
+                    pair = pack_move(min(position_first, position_second), max(position_first, position_second))
+                    if pair in searched:
+                        continue
+                    searched.add(pair)
+                    # Add the second stone and evaluate the board position
+                    score_second = sign * self.place_stone(position_second, ourColor) + CENTER_SCORE[position_second]
+                    static_score = score_first + score_second
+                    move = pack_move(position_first, position_second)
+                    # Adjust score based on the minimax search for the next level. The window is
+                    # shifted by the static score so the bounds stored in the table stay correct.
+                    if not tried:
+                        # The first pair is the expected best one and gets the full window
+                        total_score = static_score - self.alpha_beta_search(
+                            depth - 1, static_score - beta, static_score - alpha, 3 - ourColor, move, ply + 1)
+                    else:
+                        # The other pairs only have to be shown no better than alpha, with a null
+                        # window and, late ones, a reduced depth. Those that fail high are searched again.
+                        child_depth = depth - 1
+                        if reduce and tried >= Defines.LMR_FULL_PAIRS and position_first not in threat_cells \
+                                and position_second not in threat_cells \
+                                and position_second not in forced.get(position_first, ()):
+                            child_depth = max(1, child_depth - self.m_lmr_reduction)
+                            self.m_reductions += 1
+                        total_score = static_score - self.alpha_beta_search(
+                            child_depth, static_score - alpha - Defines.PVS_WINDOW, static_score - alpha,
+                            3 - ourColor, move, ply + 1)
+                        if child_depth < depth - 1 and total_score > alpha:
+                            self.m_researches += 1
+                            child_depth = depth - 1
+                            total_score = static_score - self.alpha_beta_search(
+                                child_depth, static_score - alpha - Defines.PVS_WINDOW, static_score - alpha,
+                                3 - ourColor, move, ply + 1)
+                        if alpha < total_score < beta:
+                            self.m_researches += 1
+                            total_score = static_score - self.alpha_beta_search(
+                                depth - 1, static_score - beta, static_score - alpha, 3 - ourColor, move, ply + 1)
+                    # Revert the second stone after evaluation
+                    self.remove_stone(position_second)
+                else:
+                    total_score = score_first + leaf_gain
+                    # A pair making threats is followed by the forced answers, not scored as if
+                    # the opponent could play anywhere. It needs a hot window after the first stone.
+                    if qdepth and hot_windows(self.m_hot, ourColor):
+                        self.place_stone(position_second, ourColor)
+                        if self.makes_threat(ourColor, (position_first, position_second)):
+                            total_score -= self.quiescence(3 - ourColor, total_score - beta, total_score - alpha,
+                                                           ply + 1, qdepth)
+                        self.remove_stone(position_second)
+                tried += 1
 
                 # Update the best score and best positions if the current score is higher
                 if total_score > best_score:
@@ -97,113 +452,284 @@ class SearchEngine:
 
                 # Alpha-beta cutoff
                 if alpha >= beta:
-                    self.m_beta_pod += 1
                     break
 
-            # Revert the initial move with only the first stone
-            unmake_move(self.m_board, StoneMove([position_first, position_first]))
+            # Revert the first stone
+            self.remove_stone(position_first)
+            # The cutoff ends the search of this node, not only of the second stone
+            if alpha >= beta:
+                self.m_beta_pod += 1
+                if tried == 1:
+                    self.m_beta_first += 1
+                self.update_history(ourColor, ply, depth, best_position_first, best_position_second)
+                break
 
         # Save the best move
-        if best_position_first and best_position_second:
-            bestMove.positions[0] = best_position_first
-            bestMove.positions[1] = best_position_second
-
-        bestMove.score = best_score
-
-        # Save the result in the transposition table
-        # SIN AB Time: 12.014 Node: 2257
-        # CON AB Time: 5.914 Node: 2257
-        self.transposition_table[board_hash] = {'score': best_score, 'depth': depth}
+        best_packed = 0
+        if best_position_first is not None and best_position_second is not None:
+            best_packed = pack_move(best_position_first, best_position_second)
+            if ply == 0:
+                self.m_best_packed = best_packed
+            if symmetry:
+                best_packed = transform_move(best_packed, symmetry)
+
+        # Save the result in the transposition table with its bound type
+        if best_score <= alpha_orig:
+            flag = TranspositionTable.UPPER
+        elif best_score >= beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        # A root searching only some first stones has no complete result to store, nor has a
+        # leaf of the threat extension with fewer extensions left
+        if (ply > 0 or self.m_root_firsts is None) and qdepth == self.m_quiescence_depth:
+            self.transposition_table.store(board_hash, best_score, depth, flag, best_packed)
 
         return best_score
 
-    def generate_moves(self, lastMove):
-        # Generate possible moves based on the last move
-        possible_positions = set()
-
-        # Set a fixed radius around the stones of the last move
-        radius = 2
-
-        # Iterate through cells around each stone of the last move
-        for pos in lastMove.positions:
-            for dx in range(-radius, radius + 1):
-                for dy in range(-radius, radius + 1):
-                    new_x, new_y = pos.x + dx, pos.y + dy
-                    if isValidPos(new_x, new_y) and self.m_board[new_x][new_y] == Defines.NOSTONE:
-                        possible_positions.add(StonePosition(new_x, new_y))
-
-        # Add moves within a radius of 1 from each enemy stone
-        enemy_color = 3 - self.m_chess_type
-        for i in range(len(self.m_board)):
-            for j in range(len(self.m_board[i])):
-                if self.m_board[i][j] in (enemy_color, self.m_chess_type):
-                    for dx in range(-1, 2):  # Radius of 1
-                        for dy in range(-1, 2):
-                            new_x, new_y = i + dx, j + dy
-                            if isValidPos(new_x, new_y) and self.m_board[new_x][new_y] == Defines.NOSTONE:
-                                possible_positions.add(StonePosition(new_x, new_y))
-
-        return list(possible_positions)
-
-    def evaluate_position(self, ourColor, position):
-        WIN_SCORE = float('inf')
-        LOSE_SCORE = float('-inf')
-        LINE_MULTIPLIER = [0, 1, 10, 50, 200, 500]  # Scores for different line lengths
-        CENTER_BONUS = 10
-        BLOCK_THREAT_MULTIPLIER = 500  # Increased weight for blocking opponent's line
-
-        def count_in_direction(x, y, dx, dy, color):
-            # Count stones in a specific direction and open ends
-            count, open_ends = 0, 0
-            while isValidPos(x, y) and self.m_board[x][y] == color:
-                count += 1
-                x += dx
-                y += dy
-            if isValidPos(x, y) and self.m_board[x][y] == Defines.NOSTONE:
-                open_ends += 1
-            return count, open_ends
-
-        x, y = position.x, position.y
-        enemy_color = 3 - ourColor
-
-        total_score = 0
-        for dx, dy in [(1, 0), (0, 1), (1, 1), (-1, 1), (1, -1), (-1, -1), (-1, 0), (0, -1)]:
-            our_count, our_open_ends = count_in_direction(x + dx, y + dy, dx, dy, ourColor)
-            our_count_reverse, our_open_ends_reverse = count_in_direction(x - dx, y - dy, -dx, -dy, ourColor)
-            our_total_count = our_count + our_count_reverse
-            our_total_open_ends = our_open_ends + our_open_ends_reverse
-
-            enemy_count, enemy_open_ends = count_in_direction(x + dx, y + dy, dx, dy, enemy_color)
-            enemy_count_reverse, enemy_open_ends_reverse = count_in_direction(x - dx, y - dy, -dx, -dy, enemy_color)
-            enemy_total_count = enemy_count + enemy_count_reverse
-            enemy_total_open_ends = enemy_open_ends + enemy_open_ends_reverse
-
-            if our_total_count >= 6:
-                return WIN_SCORE  # Winning condition
-            if enemy_total_count >= 6:
-                return LOSE_SCORE  # Losing condition
-
-            # Scoring our lines
-            if our_total_open_ends > 0:  # Only score if there are open ends
-                total_score += LINE_MULTIPLIER[our_total_count] * our_total_open_ends
-
-            # Scoring for blocking opponent's lines
-            if enemy_total_count >= 4 and enemy_total_open_ends > 0:  # Blocking strong enemy lines
-                total_score += BLOCK_THREAT_MULTIPLIER
-                if enemy_total_count >= 5:
-                    total_score += BLOCK_THREAT_MULTIPLIER
-
-        # Bonus for being closer to the center of the board
-        center_x, center_y = 9, 9
-        distance_to_center = ((x - center_x) ** 2 + (y - center_y) ** 2) ** 0.5
-        center_bonus = CENTER_BONUS / (1 + distance_to_center)
-
-        return total_score + center_bonus
+    def quiescence(self, ourColor, alpha, beta, ply, qdepth):
+        # Value for ourColor of a leaf where the opponent just made threats, relative to the
+        # position like alpha_beta_search. Only the pairs that block every threat are searched,
+        # each followed by the opponent's own leaf move: the forcing pair gains a tempo, and
+        # like any leaf the line ends with ourColor to move. qdepth bounds the extensions
+        # below it.
+        self.m_total_nodes += 1
+        self.m_quiescence_nodes += 1
+        if self.m_deadline is not None and not self.m_total_nodes & Defines.TIME_CHECK_NODES \
+                and (self.m_stop or time.perf_counter() >= self.m_deadline):
+            raise SearchTimeout()
+        if six_windows(self.m_hot, 3 - ourColor):
+            return Defines.MININT
+        if self.m_threat_search.immediate_win(ourColor):
+            return Defines.MAXINT
+        threats = self.m_threat_search.threat_cells(live_windows(self.m_codes, 3 - ourColor, THREAT_STONES))
+        if not threats:
+            return 0
+        if ThreatSearch.blockers_needed(threats) > 2:
+            return Defines.MININT
+
+        blocks = self.order_cells(ourColor, list(set().union(*threats)))
+        best_score = float('-inf')
+        sign = 1 if ourColor == Defines.BLACK else -1
+        for k, position_first in enumerate(blocks):
+            score_first = sign * self.place_stone(position_first, ourColor) + CENTER_SCORE[position_first]
+            # The second stone blocks the threats the first one left, or goes to the best cell
+            rest = [cells for cells in threats if position_first not in cells]
+            if rest:
+                second_stones = [cell for cell in blocks[k + 1:] if all(cell in cells for cells in rest)]
+            else:
+                position_second, gain = self.best_second_stone(ourColor, self.generate_moves(0, ourColor))
+                second_stones = (position_second,) if position_second is not None else ()
+            for position_second in second_stones:
+                static_score = score_first + sign * self.place_stone(position_second, ourColor) \
+                    + CENTER_SCORE[position_second]
+                total_score = static_score - self.alpha_beta_search(
+                    1, static_score - beta, static_score - alpha, 3 - ourColor,
+                    pack_move(position_first, position_second), ply + 1, qdepth - 1)
+                self.remove_stone(position_second)
+                if total_score > best_score:
+                    best_score = total_score
+                if best_score > alpha:
+                    alpha = best_score
+                if alpha >= beta:
+                    break
+            self.remove_stone(position_first)
+            if alpha >= beta:
+                break
+        return best_score if best_score > float('-inf') else Defines.MININT
+
+    def makes_threat(self, color, cells):
+        # True when a window through one of the cells is a threat of color: live with
+        # THREAT_STONES stones or more
+        codes = self.m_codes
+        for cell in cells:
+            for w, power in CELL_WINDOWS[cell]:
+                code = codes[w]
+                if PATTERN_OWNER[code] == color and PATTERN_STONES[code] >= THREAT_STONES:
+                    return True
+        return False
+
+    def aspiration_search(self, depth, ourColor, preMove, guess):
+        # Root search in a window of m_aspiration_window around the guessed score, the one of
+        # the previous iteration. When the score falls outside, that side of the window is
+        # opened and the root searched again.
+        window = self.m_aspiration_window
+        if guess is None or not window or abs(guess) >= Defines.MAXINT:
+            return self.alpha_beta_search(depth, Defines.MININT, Defines.MAXINT, ourColor, preMove)
+        alpha, beta = guess - window, guess + window
+        while True:
+            score = self.alpha_beta_search(depth, alpha, beta, ourColor, preMove)
+            if score <= alpha and alpha > Defines.MININT:
+                alpha = Defines.MININT
+            elif score >= beta and beta < Defines.MAXINT:
+                beta = Defines.MAXINT
+            else:
+                return score
+            self.m_aspiration_fails += 1
+
+    def iterative_deepening(self, max_depth, ourColor, bestMove, preMove, time_budget=None):
+        # Search at depth 1, 2, ... max_depth. With a time budget in seconds, stop when it runs
+        # out and keep the best move of the last completed iteration. The first iteration is
+        # never interrupted so there is always a move.
+        start = time.perf_counter()
+        root_board = self.m_board[:]
+        preMove = move_to_packed(preMove)  # The search works on packed moves, bestMove may be preMove
+        score = Defines.MININT
+
+        # A forced win found by the threat-space search is played without the full search
+        threat_deadline = start + time_budget * Defines.THREAT_TIME_RATIO if time_budget else None
+        self.m_threat_result = self.m_threat_search.solve(ourColor, Defines.THREAT_ROOT_DEPTH,
+                                                          Defines.THREAT_ROOT_NODES, threat_deadline)
+        result, line = self.m_threat_result
+        if result == ThreatSearch.WIN and not self.check_first_move():
+            bestMove.positions = packed_to_move(line[0]).positions
+            bestMove.score = Defines.MAXINT
+            self.m_iterations.append((0, Defines.MAXINT, self.m_total_nodes, time.perf_counter() - start,
+                                      str(bestMove)))
+            return Defines.MAXINT
+        for depth in range(1, max_depth + 1):
+            self.m_best_packed = 0
+            self.m_alphabeta_depth = depth
+            # The score swings between odd and even depths, the one two plies up is the better
+            # guess. Depth 1 only scores the root statically and guesses nothing.
+            guess = self.m_iterations[-2][1] if depth >= 4 and len(self.m_iterations) >= 2 else None
+            # Every iteration after the first can be stopped, by the clock or by m_stop
+            if depth > 1:
+                self.m_deadline = start + time_budget if time_budget else float('inf')
+            try:
+                if self.m_parallel is not None and depth > 1:
+                    iter_score = self.m_parallel.search_root(self, depth, ourColor, preMove)
+                else:
+                    iter_score = self.aspiration_search(depth, ourColor, preMove, guess)
+            except SearchTimeout:
+                # The board was left in the middle of the search
+                self.set_board(root_board)
+                break
+            score = iter_score
+            if self.m_best_packed:
+                self.m_root_move = self.m_best_packed
+                bestMove.positions = packed_to_move(self.m_root_move).positions
+            bestMove.score = score
+            elapsed = time.perf_counter() - start
+            self.m_iterations.append((depth, score, self.m_total_nodes, elapsed, str(bestMove)))
+            # Stop on a decided game, or when the next iteration would not finish in time
+            if abs(score) >= Defines.MAXINT:
+                break
+            if time_budget and elapsed > time_budget * Defines.NEXT_ITERATION_RATIO:
+                break
+        self.m_deadline = None
+        return score
+
+    @staticmethod
+    def order_tt_move(move_possibilities, tt_move):
+        # Move the two stones of the stored best move to the front of the list, so the
+        # stored pair is the first one searched
+        for cell in reversed(unpack_move(tt_move)):
+            if cell in move_possibilities:
+                move_possibilities.remove(cell)
+                move_possibilities.insert(0, cell)
+
+    def generate_moves(self, lastMove, ourColor=None):
+        # Generate possible moves: the incrementally maintained candidate set plus the
+        # empty cells around the stones of the packed last move, 0 for none. With the color
+        # to move, the empty cells of its hot windows and of the opponent's threats are added
+        # too: they can be out of reach of both radii, like the end of an open four.
+        possible_cells = set(self.m_candidates)
+        board = self.m_board
+        if lastMove and self.m_last_move_radius > self.m_candidate_radius:
+            near_last_move = neighbour_cells(self.m_last_move_radius)
+            for last in unpack_move(lastMove):
+                for cell in near_last_move[last]:
+                    if board[cell] == Defines.NOSTONE:
+                        possible_cells.add(cell)
+        if ourColor is not None:
+            windows = []
+            if hot_windows(self.m_hot, ourColor):
+                windows += live_windows(self.m_codes, ourColor, HOT_STONES)
+            if hot_windows(self.m_hot, 3 - ourColor):
+                windows += live_windows(self.m_codes, 3 - ourColor, THREAT_STONES)
+            for w in windows:
+                possible_cells.update(cell for cell in WINDOWS[w] if board[cell] == Defines.NOSTONE)
+        return list(possible_cells)
+
+    def evaluate_position(self, ourColor, cell):
+        # Score gained by ourColor when putting a stone on the empty cell, looked up in the
+        # pattern tables without changing the board
+        codes = self.m_codes
+        gain = 0
+        for w, power in CELL_WINDOWS[cell]:
+            code = codes[w]
+            gain += PATTERN_SCORE[code + ourColor * power] - PATTERN_SCORE[code]
+        if ourColor == Defines.WHITE:
+            gain = -gain
+        return gain + CENTER_SCORE[cell]
+
+    def order_cells(self, ourColor, cells):
+        # Cells by static gain plus history, best first
+        gains = self.score_cells(ourColor, cells)
+        history = self.m_history[ourColor]
+        return [cell for gain, cell in sorted(zip([gain + history[cell] for gain, cell in zip(gains, cells)], cells),
+                                              reverse=True)]
+
+    def forced_pairs(self, tt_move, ply, cells):
+        # {first stone: [second stones]} of the stored best move and the killer pairs of the
+        # ply that can be played among the cells, in that order
+        forced = {}
+        cell_set = set(cells)
+        for move in (tt_move, *self.m_killers[ply]):
+            if move:
+                first, second = unpack_move(move)
+                if first != second and first in cell_set and second in cell_set \
+                        and second not in forced.get(first, ()):
+                    forced.setdefault(first, []).append(second)
+        return forced
+
+    def update_history(self, ourColor, ply, depth, first, second):
+        # A pair made a cutoff: keep it as a killer of the ply and credit its stones
+        move = pack_move(first, second)
+        killers = self.m_killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        history = self.m_history[ourColor]
+        history[first] += depth * depth
+        history[second] += depth * depth
+
+    def threat_cells(self):
+        # Empty cells of the hot windows of both colors. The beams never drop them: they make
+        # or block threats, which the static gain of a single stone underrates.
+        cells = set()
+        board = self.m_board
+        for color in (Defines.BLACK, Defines.WHITE):
+            if hot_windows(self.m_hot, color):
+                for w in live_windows(self.m_codes, color, HOT_STONES):
+                    cells.update(cell for cell in WINDOWS[w] if board[cell] == Defines.NOSTONE)
+        return cells
+
+    def score_cells(self, ourColor, cells):
+        # evaluate_position of every cell, in one vectorized pass when NumPy is there
+        if self.m_vector_scoring and len(cells) >= VECTOR_MIN_CELLS:
+            return score_cells(self.m_codes, ourColor, cells).tolist()
+        return [self.evaluate_position(ourColor, cell) for cell in cells]
+
+    def best_second_stone(self, ourColor, cells):
+        # (cell, gain) of the empty cell with the best gain, (None, 0) when there is none
+        cells = [cell for cell in cells if self.m_board[cell] == Defines.NOSTONE]
+        if not cells:
+            return None, 0
+        gains = self.score_cells(ourColor, cells)
+        best = max(range(len(cells)), key=gains.__getitem__)
+        return cells[best], gains[best]
+
+    def second_stones(self, ourColor, cells):
+        # Second stones to search after the first one is placed: the m_second_stones empty
+        # cells with the best order and the threat cells, or all of them
+        if not self.m_second_stones or len(cells) <= self.m_second_stones + 1:
+            return cells
+        cells = self.order_cells(ourColor, [cell for cell in cells if self.m_board[cell] == Defines.NOSTONE])
+        threat_cells = self.threat_cells()
+        return [cell for k, cell in enumerate(cells) if k < self.m_second_stones or cell in threat_cells]
 
     def check_first_move(self):
         # Check if it's the first move of the game
-        for i in range(1, len(self.m_board) - 1):
-            for j in range(1, len(self.m_board[i]) - 1):
-                if self.m_board[i][j] != Defines.NOSTONE:
-                    return False
-        return True
+        return self.m_board.count(Defines.NOSTONE) == Defines.GRID_COUNT
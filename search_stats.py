@@ -0,0 +1,88 @@
+import json
+import sys
+import time
+
+
+class SearchStats:
+    # Per-phase timers of a SearchEngine. Enabling them replaces the engine's hot methods
+    # with timed wrappers on the instance, so a search without them runs the plain methods
+    # and pays nothing. Phases may nest: the threat-space search also places stones.
+
+    # Phase name of each timed method, per object of the engine. The cells are scored through
+    # score_cells, in one NumPy pass or by evaluate_position, and the Zobrist key is updated
+    # by place_stone and remove_stone, so its time is part of make_unmake.
+    ENGINE_PHASES = {
+        "generate_moves": "move_generation",
+        "score_cells": "evaluation",
+        "place_stone": "make_unmake",
+        "remove_stone": "make_unmake",
+    }
+    TABLE_PHASES = {"probe": "tt_probe", "store": "tt_store"}
+    THREAT_PHASES = {"solve": "threat"}
+
+    def __init__(self, engine):
+        self.m_engine = engine
+        self.m_times = {}  # Seconds spent per phase
+        self.m_calls = {}  # Calls per phase
+        self.m_wrapped = []  # (object, method name) of the installed wrappers
+        self.reset()
+
+    def reset(self):
+        # In place, the wrappers keep references to the dicts
+        phases = set(SearchStats.ENGINE_PHASES.values()) | set(SearchStats.TABLE_PHASES.values()) \
+            | set(SearchStats.THREAT_PHASES.values())
+        for phase in sorted(phases):
+            self.m_times[phase] = 0.0
+            self.m_calls[phase] = 0
+
+    def enable(self):
+        engine = self.m_engine
+        for obj, phases in ((engine, SearchStats.ENGINE_PHASES),
+                            (engine.transposition_table, SearchStats.TABLE_PHASES),
+                            (engine.m_threat_search, SearchStats.THREAT_PHASES)):
+            for name, phase in phases.items():
+                setattr(obj, name, self.timed(getattr(obj, name), phase))
+                self.m_wrapped.append((obj, name))
+
+    def disable(self):
+        # Remove the wrappers, the class methods are found again
+        for obj, name in self.m_wrapped:
+            delattr(obj, name)
+        self.m_wrapped = []
+
+    def timed(self, method, phase):
+        times = self.m_times
+        calls = self.m_calls
+        perf_counter = time.perf_counter
+
+        def wrapper(*args):
+            start = perf_counter()
+            result = method(*args)
+            times[phase] += perf_counter() - start
+            calls[phase] += 1
+            return result
+        return wrapper
+
+    def report(self, seconds):
+        # Counters of the engine's last search and the phase timers, as a dict
+        engine = self.m_engine
+        nodes = engine.m_total_nodes
+        return {
+            "depth": engine.m_iterations[-1][0] if engine.m_iterations else 0,
+            "time": round(seconds, 4),
+            "nps": round(nodes / seconds) if seconds > 0 else 0,
+            **engine.counters(),
+            "phases": {phase: {"calls": self.m_calls[phase], "time": round(self.m_times[phase], 4)}
+                       for phase in self.m_times},
+        }
+
+    @staticmethod
+    def write(report, path=None):
+        # One JSON line on stderr, or appended to the stats file
+        line = json.dumps(report)
+        if path:
+            with open(path, "a") as file:
+                file.write(line + "\n")
+        else:
+            print(line, file=sys.stderr)
+            sys.stderr.flush()
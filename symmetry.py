@@ -0,0 +1,67 @@
+from tools import *
+from transposition import ZOBRIST_KEYS, ZOBRIST_SIDE, pack_move, unpack_move
+
+# The 8 symmetries of the square board: 4 rotations, each with or without a mirror. The
+# border ring is symmetric too, so a symmetry maps every cell of the flat board, and the
+# center cell (10, 10) to itself. Positions that only differ by a symmetry have the same
+# canonical key: the smallest Zobrist key of their 8 images.
+
+SYMMETRY_COUNT = 8
+
+
+def _transform(symmetry, x, y):
+    # Image of (x, y) by a symmetry: a transposition, then mirrors of each axis
+    last = Defines.GRID_NUM - 1
+    if symmetry & 4:
+        x, y = y, x
+    if symmetry & 2:
+        x = last - x
+    if symmetry & 1:
+        y = last - y
+    return x, y
+
+
+# SYMMETRY_CELLS[s][cell] is the image of cell by symmetry s, INVERSE_SYMMETRY[s] the
+# symmetry that maps it back.
+SYMMETRY_CELLS = tuple(tuple(cell_index(*_transform(s, *divmod(cell, Defines.GRID_NUM)))
+                             for cell in range(Defines.GRID_CELLS)) for s in range(SYMMETRY_COUNT))
+INVERSE_SYMMETRY = tuple(next(t for t in range(SYMMETRY_COUNT)
+                              if all(SYMMETRY_CELLS[t][SYMMETRY_CELLS[s][cell]] == cell
+                                     for cell in range(Defines.GRID_CELLS)))
+                         for s in range(SYMMETRY_COUNT))
+# SYMMETRY_KEYS[s][color][cell] is the Zobrist key of a stone on the image of cell, so the
+# key of the image of a board can be updated stone by stone like the plain key.
+SYMMETRY_KEYS = tuple(tuple(tuple(ZOBRIST_KEYS[color][SYMMETRY_CELLS[s][cell]] for cell in range(Defines.GRID_CELLS))
+                            for color in range(3)) for s in range(SYMMETRY_COUNT))
+
+# SYMMETRY_STONE_KEYS[color][cell] is the tuple of the keys of a stone on cell in the 8 images.
+SYMMETRY_STONE_KEYS = tuple(tuple(tuple(SYMMETRY_KEYS[s][color][cell] for s in range(SYMMETRY_COUNT))
+                                  for cell in range(Defines.GRID_CELLS)) for color in range(3))
+
+
+def symmetry_hashes(board):
+    # Zobrist key of every image of the board, computed from scratch
+    keys = [0] * SYMMETRY_COUNT
+    for cell, stone in enumerate(board):
+        if stone == Defines.BLACK or stone == Defines.WHITE:
+            for s in range(SYMMETRY_COUNT):
+                keys[s] ^= SYMMETRY_KEYS[s][stone][cell]
+    return keys
+
+
+def canonical_hash(board, color):
+    # (key, symmetry): the smallest key of the images of the board with color to move, and
+    # the symmetry that gives it
+    return canonical_key(symmetry_hashes(board), color)
+
+
+def canonical_key(keys, color):
+    # canonical_hash from the keys of the images of a board
+    side = ZOBRIST_SIDE if color == Defines.WHITE else 0
+    return min((key ^ side, s) for s, key in enumerate(keys))
+
+
+def transform_move(packed, symmetry):
+    # Image of a packed move by a symmetry
+    first, second = unpack_move(packed)
+    return pack_move(SYMMETRY_CELLS[symmetry][first], SYMMETRY_CELLS[symmetry][second])
@@ -0,0 +1,175 @@
+import time
+from itertools import combinations
+from tools import *
+from patterns import *
+from transposition import pack_move
+
+
+class ThreatSearch:
+    # Threat-space search for Connect6. A threat is a live window with THREAT_STONES or
+    # more stones of the attacker: the defender must put a stone in it or lose. The
+    # attacker only plays pairs that leave at least two threats (the defender needs both
+    # stones to block them) and the defender only plays the pairs that block them, so the
+    # tree is tiny compared with the full-width search. Three threats win outright.
+
+    # Results of solve()
+    UNKNOWN = 0
+    WIN = 1
+    LOSS = 2
+
+    def __init__(self, engine):
+        self.m_engine = engine  # SearchEngine whose board and windows are searched
+        self.m_nodes = 0  # Nodes of the current solve
+        self.m_total_nodes = 0  # Nodes since the last reset, reported with the search
+        self.m_node_limit = 0
+        self.m_deadline = None
+
+    def solve(self, color, max_depth, node_limit, deadline=None):
+        # Look for a forced win of color, which is to move, in at most max_depth attacker
+        # moves. Returns (result, line): WIN with the packed moves of the main line, LOSS
+        # when the opponent already has more threats than two stones can block, or UNKNOWN.
+        self.m_nodes = 0
+        self.m_node_limit = node_limit
+        self.m_deadline = deadline
+        codes = self.m_engine.m_codes
+        enemy_threats = self.threat_cells(live_windows(codes, 3 - color, THREAT_STONES))
+        # Deepen one attacker move at a time so the shortest win is found first
+        for depth in range(1, max_depth + 1):
+            line = []
+            if self.attack(color, depth, line):
+                return ThreatSearch.WIN, line
+            if self.m_nodes > self.m_node_limit:
+                break
+        if self.blockers_needed(enemy_threats) > 2 and not self.immediate_win(color):
+            return ThreatSearch.LOSS, []
+        return ThreatSearch.UNKNOWN, []
+
+    def threat_cells(self, windows):
+        # The set of empty cells of every window
+        board = self.m_engine.m_board
+        return [{cell for cell in WINDOWS[w] if board[cell] == Defines.NOSTONE} for w in windows]
+
+    @staticmethod
+    def blockers_needed(threat_cells):
+        # Minimum number of stones that hit every set of cells, 3 meaning three or more.
+        # Any solution hits the first set, so trying its cells is exact for two stones.
+        if not threat_cells:
+            return 0
+        if set.intersection(*threat_cells):
+            return 1
+        for cell in threat_cells[0]:
+            rest = [cells for cells in threat_cells if cell not in cells]
+            if set.intersection(*rest):
+                return 2
+        return 3
+
+    def immediate_win(self, color):
+        # Packed move that makes six for color right now, or 0
+        engine = self.m_engine
+        for w in live_windows(engine.m_codes, color, THREAT_STONES):
+            empty = [cell for cell in WINDOWS[w] if engine.m_board[cell] == Defines.NOSTONE]
+            if len(empty) == 1:
+                # The second stone can go anywhere
+                other = next((cell for cell in engine.m_candidates if cell != empty[0]), None)
+                if other is None:
+                    continue
+                empty.append(other)
+            first, second = empty
+            engine.place_stone(first, color)
+            engine.place_stone(second, color)
+            won = six_windows(engine.m_hot, color)
+            engine.remove_stone(second)
+            engine.remove_stone(first)
+            if won:
+                return pack_move(first, second)
+        return 0
+
+    def out_of_budget(self):
+        self.m_nodes += 1
+        self.m_total_nodes += 1
+        if self.m_nodes > self.m_node_limit:
+            return True
+        return self.m_deadline is not None and not self.m_nodes & 63 and time.perf_counter() >= self.m_deadline
+
+    def attack(self, color, depth, line):
+        # True when color, to move, wins by continuous threats; line gets the main line
+        if self.out_of_budget():
+            return False
+        win = self.immediate_win(color)
+        if win:
+            line.append(win)
+            return True
+        if depth <= 0:
+            return False
+
+        engine = self.m_engine
+        board = engine.m_board
+        codes = engine.m_codes
+        enemy = 3 - color
+        # The defender has no six to make, but its threats must be blocked by this move
+        enemy_threats = self.threat_cells(live_windows(codes, enemy, THREAT_STONES))
+        if self.blockers_needed(enemy_threats) > 2:
+            return False
+        # A stone in a window with three of our stones makes a threat, so does a pair of stones
+        # in a window with two. The blockers of the defender's threats are added to both.
+        single_cells = set()
+        pairs = set()
+        for w in live_windows(codes, color, THREAT_STONES - 2):
+            empty = [cell for cell in WINDOWS[w] if board[cell] == Defines.NOSTONE]
+            if PATTERN_STONES[codes[w]] == THREAT_STONES - 2:
+                pairs.update(combinations(empty, 2))
+            else:
+                single_cells.update(empty)
+        for blockers in enemy_threats:
+            single_cells |= blockers
+        pairs.update(combinations(single_cells, 2))
+
+        for first, second in sorted({(min(pair), max(pair)) for pair in pairs}):
+            if enemy_threats and any(first not in blockers and second not in blockers for blockers in enemy_threats):
+                continue
+            engine.place_stone(first, color)
+            engine.place_stone(second, color)
+            # We had no threat before this move, so every threat goes through its stones
+            threat_windows = {w for cell in (first, second) for w, power in CELL_WINDOWS[cell]
+                              if PATTERN_OWNER[codes[w]] == color and PATTERN_STONES[codes[w]] >= THREAT_STONES}
+            threats = self.threat_cells(threat_windows)
+            needed = self.blockers_needed(threats)
+            won = False
+            defence = []
+            if needed > 2:
+                won = True
+            elif needed == 2 and depth > 1:
+                won = self.defend(color, threats, depth - 1, defence)
+            engine.remove_stone(second)
+            engine.remove_stone(first)
+            if won:
+                line.append(pack_move(first, second))
+                line.extend(defence)
+                return True
+            if self.m_nodes > self.m_node_limit:
+                return False
+        return False
+
+    def defend(self, color, threats, depth, line):
+        # True when every pair of the defender that blocks all threats loses to a new attack
+        engine = self.m_engine
+        enemy = 3 - color
+        replies = set()
+        for first in threats[0]:
+            rest = [cells for cells in threats if first not in cells]
+            for second in set.intersection(*rest):
+                replies.add((min(first, second), max(first, second)))
+        for first, second in sorted(replies):
+            engine.place_stone(first, enemy)
+            engine.place_stone(second, enemy)
+            attack_line = []
+            won = self.attack(color, depth, attack_line)
+            engine.remove_stone(second)
+            engine.remove_stone(first)
+            if not won:
+                return False
+            if not line:
+                # Keep the first refuted defence as the main line
+                line.append(pack_move(first, second))
+                line.extend(attack_line)
+        return True
@@ -1,4 +1,7 @@
 from defines import *
+import atexit
+import queue
+import threading
 import time
 
 
@@ -7,65 +10,124 @@ def isValidPos(x, y):
     return 0 <= x < Defines.GRID_NUM and 0 <= y < Defines.GRID_NUM
 
 
+# Index of the point (x, y) in the flat board.
+def cell_index(x, y):
+    return x * Defines.GRID_NUM + y
+
+
+def new_board():
+    # The board is a flat bytearray of GRID_NUM * GRID_NUM cells, row by row, with a
+    # BORDER sentinel around it, so walking a line always stops on the border.
+    board = bytearray(Defines.GRID_CELLS)
+    init_board(board)
+    return board
+
+
 def init_board(board):
-    for i in range(21):
-        board[i][0] = board[0][i] = board[i][Defines.GRID_NUM - 1] = board[Defines.GRID_NUM - 1][i] = Defines.BORDER
+    board[:] = bytes([Defines.BORDER]) * Defines.GRID_CELLS
     for i in range(1, Defines.GRID_NUM - 1):
-        for j in range(1, Defines.GRID_NUM - 1):
-            board[i][j] = Defines.NOSTONE
+        board[cell_index(i, 1):cell_index(i, Defines.GRID_NUM - 1)] = bytes(Defines.GRID_NUM - 2)
 
 
 def make_move(board, move, color):
-    board[move.positions[0].x][move.positions[0].y] = color
-    board[move.positions[1].x][move.positions[1].y] = color
+    board[move.positions[0].x * Defines.GRID_NUM + move.positions[0].y] = color
+    board[move.positions[1].x * Defines.GRID_NUM + move.positions[1].y] = color
 
 
 def unmake_move(board, move):
-    board[move.positions[0].x][move.positions[0].y] = Defines.NOSTONE
-    board[move.positions[1].x][move.positions[1].y] = Defines.NOSTONE
+    board[move.positions[0].x * Defines.GRID_NUM + move.positions[0].y] = Defines.NOSTONE
+    board[move.positions[1].x * Defines.GRID_NUM + move.positions[1].y] = Defines.NOSTONE
 
 
 def is_win_by_premove(board, preMove):
-    directions = [(1, 0), (0, 1), (1, 1), (-1, 1)]
     for pos in preMove.positions:
-        for dx, dy in directions:
+        cell = pos.x * Defines.GRID_NUM + pos.y
+        color = board[cell]
+        if color == Defines.NOSTONE:
+            continue
+        for offset in Defines.DIRECTIONS:
             count = 1  # Count the current stone
-            # Check in the positive direction
-            x, y = pos.x, pos.y
-            while isValid(board, x + dx, y + dy) and board[x + dx][y + dy] == board[pos.x][pos.y] and board[x + dx][
-                y + dy] != Defines.NOSTONE:
+            # Check in the positive direction, the border stops the walk
+            i = cell + offset
+            while board[i] == color:
                 count += 1
-                x += dx
-                y += dy
+                i += offset
             # Check in the negative direction
-            x, y = pos.x, pos.y
-            while isValid(board, x - dx, y - dy) and board[x - dx][y - dy] == board[pos.x][pos.y] and board[x + dx][
-                y + dy] != Defines.NOSTONE:
+            i = cell - offset
+            while board[i] == color:
                 count += 1
-                x -= dx
-                y -= dy
+                i -= offset
             # Winning condition
             if count >= 6:
                 return True
     return False
 
 
-def isValid(board, x, y):
-    return 0 <= x < len(board) and 0 <= y < len(board[0]) and board[x][y] != Defines.BORDER
+def neighbour_cells(radius):
+    # For every cell, the tuple of cells inside the board within the given radius,
+    # excluding the cell itself. Built once per radius.
+    if radius not in _neighbour_cache:
+        table = []
+        for x in range(Defines.GRID_NUM):
+            for y in range(Defines.GRID_NUM):
+                table.append(tuple(cell_index(x + dx, y + dy)
+                                   for dx in range(-radius, radius + 1)
+                                   for dy in range(-radius, radius + 1)
+                                   if (dx or dy) and 0 < x + dx < Defines.GRID_NUM - 1
+                                   and 0 < y + dy < Defines.GRID_NUM - 1))
+        _neighbour_cache[radius] = table
+    return _neighbour_cache[radius]
+
+
+_neighbour_cache = {}
+
+
+# Queue of the lines for the logger thread, created by the first log_to_file
+_log_queue = None
+_log_thread = None
 
 
 def log_to_file(msg):
+    # Queue the message, the logger thread appends it to the log file with the lines queued
+    # meanwhile, so the caller never waits for the disk
+    global _log_queue, _log_thread
+    if _log_queue is None:
+        _log_queue = queue.Queue()
+        _log_thread = threading.Thread(target=_write_log, args=(_log_queue,), daemon=True)
+        _log_thread.start()
+        atexit.register(close_log)
+    _log_queue.put(f"[{time.ctime(time.time())}] - {msg}\n")
+    return 0
+
+
+def close_log():
+    # Write the queued lines and stop the logger thread
+    global _log_queue, _log_thread
+    if _log_queue is not None:
+        _log_queue.put(None)
+        _log_thread.join()
+        _log_queue = _log_thread = None
+
+
+def _write_log(lines):
     g_log_file_name = Defines.LOG_FILE
     try:
-        with open(g_log_file_name, "a") as file:
-            tm = time.time()
-            ptr = time.ctime(tm)
-            ptr = ptr[:-1]
-            file.write(f"[{ptr}] - {msg}\n")
-        return 0
-    except Exception as e:
+        file = open(g_log_file_name, "a")
+    except OSError:
         print(f"Error: Can't open log file - {g_log_file_name}")
-        return -1
+        file = None
+    while True:
+        batch = [lines.get()]
+        while not lines.empty():
+            batch.append(lines.get())
+        done = None in batch
+        if file is not None:
+            file.writelines(line for line in batch if line is not None)
+            file.flush()
+        if done:
+            break
+    if file is not None:
+        file.close()
 
 
 def msg2move(msg):
@@ -84,22 +146,35 @@ def msg2move(msg):
         return move
 
 
-def print_board(board, preMove=None):
-    print("   " + "".join([chr(i + ord('A') - 1) + " " for i in range(1, Defines.GRID_NUM - 1)]))
+def board_from_moves(moves):
+    # Board after a game given as msg2move strings, black first. Returns the board, the
+    # color to move and the last move, None on an empty game.
+    board = new_board()
+    color = Defines.BLACK
+    last_move = None
+    for msg in moves:
+        last_move = msg2move(msg)
+        make_move(board, last_move, color)
+        color ^= 3
+    return board, color, last_move
+
+
+def print_board(board, preMove=None, file=None):
+    print("   " + "".join([chr(i + ord('A') - 1) + " " for i in range(1, Defines.GRID_NUM - 1)]), file=file)
     for i in range(1, Defines.GRID_NUM - 1):
-        print(f"{chr(ord('A') - 1 + i)}", end=" ")
+        print(f"{chr(ord('A') - 1 + i)}", end=" ", file=file)
         for j in range(1, Defines.GRID_NUM - 1):
             x = Defines.GRID_NUM - 1 - j
             y = i
-            stone = board[x][y]
+            stone = board[cell_index(x, y)]
             if stone == Defines.NOSTONE:
-                print(" -", end="")
+                print(" -", end="", file=file)
             elif stone == Defines.BLACK:
-                print(" O", end="")
+                print(" O", end="", file=file)
             elif stone == Defines.WHITE:
-                print(" *", end="")
+                print(" *", end="", file=file)
             elif stone == Defines.POSSIBLE:
-                print(" +", end="")
-        print(" ", end="")
-        print(f"{chr(ord('A') - 1 + i)}", end="\n")
-    print("   " + "".join([chr(i + ord('A') - 1) + " " for i in range(1, Defines.GRID_NUM - 1)]))
\ No newline at end of file
+                print(" +", end="", file=file)
+        print(" ", end="", file=file)
+        print(f"{chr(ord('A') - 1 + i)}", end="\n", file=file)
+    print("   " + "".join([chr(i + ord('A') - 1) + " " for i in range(1, Defines.GRID_NUM - 1)]), file=file)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import random
+from defines import *
+
+# Zobrist keys, one 64-bit random number per (color, cell). The seed is fixed so
+# that keys are the same in every run and every process.
+_zobrist_random = random.Random(Defines.ZOBRIST_SEED)
+ZOBRIST_KEYS = [[_zobrist_random.getrandbits(64) for cell in range(Defines.GRID_CELLS)] for color in range(3)]
+ZOBRIST_SIDE = _zobrist_random.getrandbits(64)  # Xored in when white is to move.
+
+
+def zobrist_hash(board):
+    # Full Zobrist hash of a board, used to seed the incremental key.
+    key = 0
+    for cell, stone in enumerate(board):
+        if stone == Defines.BLACK or stone == Defines.WHITE:
+            key ^= ZOBRIST_KEYS[stone][cell]
+    return key
+
+
+def pack_move(first, second):
+    # Pack the two cells of a move into an int, 9 bits per cell. 0 means "no move"
+    # because cell 0 is always border.
+    return first | (second << 9)
+
+
+def unpack_move(packed):
+    # Inverse of pack_move, returns the two cells.
+    return packed & 0x1FF, packed >> 9
+
+
+def packed_to_move(packed):
+    # New StoneMove of a packed move, for output
+    return StoneMove([StonePosition(*divmod(cell, Defines.GRID_NUM)) for cell in unpack_move(packed)])
+
+
+def move_to_packed(move):
+    # Packed move of a StoneMove, a one stone move has its cell twice
+    first, second = move.positions
+    return pack_move(first.x * Defines.GRID_NUM + first.y, second.x * Defines.GRID_NUM + second.y)
+
+
+class TranspositionTable:
+    # Bound types of a stored score.
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+    ENTRY_BYTES = 16  # A 64-bit check word and a 64-bit data word per entry.
+    SCORE_SCALE = 256  # Scores are stored in fixed point with this many steps per unit.
+    SCORE_LIMIT = 1000000  # Stored scores are clamped to +/- this, infinities included.
+
+    def __init__(self, size_bits=Defines.TT_SIZE_BITS, buffer=None):
+        # The table is made of 2-entry buckets: slot 0 is depth-preferred, slot 1 is
+        # always-replace. All entries live in one fixed buffer, a bytearray or the buffer
+        # of a shared memory block when several processes search together.
+        self.m_buckets = 1 << size_bits
+        self.m_mask = self.m_buckets - 1
+        entries = self.m_buckets * 2
+        if buffer is None:
+            buffer = bytearray(self.buffer_size(size_bits))
+        self.m_buffer = memoryview(buffer)
+        # Key of the entry xor its data word, so that an entry torn by two processes
+        # writing at once does not match any key (lockless hashing).
+        self.m_keys = self.m_buffer[:8 * entries].cast('Q')
+        # score << 34 | age << 28 | move << 10 | flag << 8 | depth, 0 for an empty slot.
+        self.m_data = self.m_buffer[8 * entries:16 * entries].cast('q')
+        # Generation of the current search. Entries of older searches stay usable but are
+        # the first to be replaced, so the table is kept from one move to the next.
+        self.m_age = 0
+
+    @staticmethod
+    def buffer_size(size_bits=Defines.TT_SIZE_BITS):
+        return (1 << size_bits) * 2 * TranspositionTable.ENTRY_BYTES
+
+    def clear(self):
+        self.m_buffer[:] = bytes(len(self.m_buffer))
+        self.m_age = 0
+
+    def new_search(self):
+        self.m_age = (self.m_age + 1) & 0x3F
+
+    def probe(self, key):
+        # Return (score, depth, flag, move) for the key, or None when it is not stored.
+        slot = (key & self.m_mask) << 1
+        for i in (slot, slot + 1):
+            data = self.m_data[i]
+            if data and self.m_keys[i] ^ (data & 0xFFFFFFFFFFFFFFFF) == key:
+                return (data >> 34) / self.SCORE_SCALE, data & 0xFF, (data >> 8) & 0x3, (data >> 10) & 0x3FFFF
+        return None
+
+    def store(self, key, score, depth, flag, move):
+        slot = (key & self.m_mask) << 1
+        score = max(-self.SCORE_LIMIT, min(self.SCORE_LIMIT, score))
+        data = (round(score * self.SCORE_SCALE) << 34) | (self.m_age << 28) | (move << 10) | (flag << 8) | depth
+        keys = self.m_keys
+        entries = self.m_data
+        old = entries[slot]
+        if old and keys[slot] ^ (old & 0xFFFFFFFFFFFFFFFF) == key:
+            # Same position: keep the old best move if the new entry has none.
+            if move == 0:
+                data |= old & (0x3FFFF << 10)
+        elif old and depth < old & 0xFF and (old >> 28) & 0x3F == self.m_age:
+            # The depth-preferred slot holds a deeper result of this search, always replace slot 1.
+            slot += 1
+        elif old:
+            # Demote the replaced entry to the always-replace slot.
+            keys[slot + 1] = keys[slot]
+            entries[slot + 1] = old
+        keys[slot] = key ^ (data & 0xFFFFFFFFFFFFFFFF)
+        entries[slot] = data
@@ -0,0 +1,40 @@
+from patterns import *
+
+# Optional NumPy scorer of candidate cells. It gives the same gains as
+# SearchEngine.evaluate_position for a whole list of cells in one pass: the codes of the
+# windows through every cell are gathered at once and looked up in the score table.
+# Without NumPy, VECTOR_SCORING is False and the search scores cell by cell.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+VECTOR_SCORING = numpy is not None
+# Below this many cells the conversion of the window codes costs more than it saves.
+VECTOR_MIN_CELLS = 16
+
+if VECTOR_SCORING:
+    _WINDOWS_PER_CELL = max(len(windows) for windows in CELL_WINDOWS)
+    # _CELL_WINDOW[cell] and _CELL_POWER[cell]: the windows through the cell and the power of
+    # the cell in each, padded with an extra window whose code is always 0 and power 0.
+    _CELL_WINDOW = numpy.full((Defines.GRID_CELLS, _WINDOWS_PER_CELL), len(WINDOWS), dtype=numpy.intp)
+    _CELL_POWER = numpy.zeros((Defines.GRID_CELLS, _WINDOWS_PER_CELL), dtype=numpy.intp)
+    for _cell, _windows in enumerate(CELL_WINDOWS):
+        for _k, (_w, _power) in enumerate(_windows):
+            _CELL_WINDOW[_cell, _k] = _w
+            _CELL_POWER[_cell, _k] = _power
+    _SCORE = numpy.array(PATTERN_SCORE, dtype=numpy.int64)
+    _CENTER = numpy.array(CENTER_SCORE)
+
+
+def score_cells(codes, color, cells):
+    # Gain of color for a stone on each of the empty cells, as a NumPy array, see
+    # SearchEngine.evaluate_position. codes are the window codes of the board.
+    window_codes = numpy.array(codes + [0], dtype=numpy.intp)
+    cells = numpy.array(cells, dtype=numpy.intp)
+    before = window_codes[_CELL_WINDOW[cells]]
+    after = before + color * _CELL_POWER[cells]
+    gains = (_SCORE[after] - _SCORE[before]).sum(axis=1)
+    if color == Defines.WHITE:
+        gains = -gains
+    return gains + _CENTER[cells]